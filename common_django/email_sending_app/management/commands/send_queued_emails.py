@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from common_django.email_sending_app.sender import send_outbox, EMAIL_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Send the emails queued in the EmailOutbox table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EMAIL_BATCH_SIZE, help='Emails sent over one connection.')
+        parser.add_argument('--limit', type=int, help='Max number of emails sent per run.')
+        parser.add_argument('--follow', action='store_true', help='Keep sending newly queued emails.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between two runs when following.')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                sent = send_outbox(options['batch_size'], options['limit'])
+                self.stdout.write(f'Sent {sent} emails.')
+                if not options['follow']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped sending emails.')
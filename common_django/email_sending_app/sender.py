@@ -0,0 +1,350 @@
+"""
+Queued, batched email sending.
+
+Two queues are available, both sending a batch of messages over a single connection of the
+email backend and retrying failed messages with an exponential backoff:
+
+    EmailQueue   in-process queue drained by a pool of worker threads, enqueuing returns
+                 immediately but queued messages are lost if the process dies
+    EmailOutbox  database table drained by send_outbox() (the send_queued_emails command),
+                 durable and shared by all processes
+
+enqueue_email() and enqueue_mass_email() (re-exported by tasks.py) pick one of them with the
+EMAIL_USE_OUTBOX setting.
+"""
+import time
+import heapq
+import queue
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger('email_sender')
+
+# Store queued emails in the EmailOutbox table instead of the in-process queue
+EMAIL_USE_OUTBOX = getattr(settings, 'EMAIL_USE_OUTBOX', False)
+
+# Number of threads sending the emails of the in-process queue
+EMAIL_QUEUE_WORKERS = getattr(settings, 'EMAIL_QUEUE_WORKERS', 4)
+
+# Max number of emails waiting in the in-process queue, enqueuing fails beyond
+EMAIL_QUEUE_MAXSIZE = getattr(settings, 'EMAIL_QUEUE_MAXSIZE', 100000)
+
+# Seconds given to the in-process queue to send the queued emails when the process exits
+EMAIL_QUEUE_SHUTDOWN_TIMEOUT = getattr(settings, 'EMAIL_QUEUE_SHUTDOWN_TIMEOUT', 30)
+
+# Emails sent over one connection of the email backend
+EMAIL_BATCH_SIZE = getattr(settings, 'EMAIL_BATCH_SIZE', 100)
+
+# Attempts to send an email before giving up, and seconds before the first retry (doubled
+# on every retry, up to EMAIL_RETRY_BACKOFF_MAX)
+EMAIL_MAX_ATTEMPTS = getattr(settings, 'EMAIL_MAX_ATTEMPTS', 5)
+EMAIL_RETRY_BACKOFF = getattr(settings, 'EMAIL_RETRY_BACKOFF', 2)
+EMAIL_RETRY_BACKOFF_MAX = getattr(settings, 'EMAIL_RETRY_BACKOFF_MAX', 300)
+
+# Seconds after which an outbox email claimed by a sender that died is sent again
+EMAIL_SENDING_TIMEOUT = getattr(settings, 'EMAIL_SENDING_TIMEOUT', 600)
+
+
+def get_retry_delay(attempts):
+    """
+    Returns the seconds to wait before retrying an email that failed attempts times.
+    """
+    return min(EMAIL_RETRY_BACKOFF * 2 ** (attempts - 1), EMAIL_RETRY_BACKOFF_MAX)
+
+
+def build_message(subject, message, recipient_list, from_email=None, html_message=None):
+    """
+    Returns the EmailMessage for the arguments of send_mail().
+    """
+    email = EmailMultiAlternatives(subject, message, from_email or settings.DEFAULT_FROM_EMAIL, recipient_list)
+    if html_message:
+        email.attach_alternative(html_message, 'text/html')
+    return email
+
+
+def send_batch(messages, batch_size=None):
+    """
+    Sends the messages over one connection of the email backend per batch_size messages.
+    Returns a list of (message, error) for the messages that couldn't be sent.
+
+    Messages are handed to the open connection one at a time, which is what the backends
+    do internally anyway, so a failure only affects the failing message and the messages
+    sent before it are never sent twice on retry.
+    """
+    batch_size = batch_size or EMAIL_BATCH_SIZE
+    failures = []
+    for start in range(0, len(messages), batch_size):
+        chunk = messages[start:start + batch_size]
+        email_connection = get_connection(fail_silently=False)
+        try:
+            email_connection.open()
+        except Exception as e:
+            # The whole chunk fails when the mail server can't be reached
+            failures.extend((message, e) for message in chunk)
+            continue
+
+        try:
+            for message in chunk:
+                try:
+                    email_connection.send_messages([message])
+                except Exception as e:
+                    failures.append((message, e))
+        finally:
+            try:
+                email_connection.close()
+            except Exception:
+                pass
+    return failures
+
+
+class EmailQueue:
+    """
+    In-process email queue, drained by a pool of worker threads sending batches of messages.
+    Failed messages are retried with an exponential backoff, up to EMAIL_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, workers=EMAIL_QUEUE_WORKERS, maxsize=EMAIL_QUEUE_MAXSIZE, batch_size=EMAIL_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.sent_count = 0
+        self.failed_count = 0
+        self._queue = queue.Queue(maxsize)
+        # Heap of (due time, sequence, attempts, message) waiting for a retry
+        self._retries = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._stopping = threading.Event()
+
+        self._threads = [
+            threading.Thread(target=self.work, name=f'email_sender_{i}', daemon=True) for i in range(workers)
+        ]
+        self._threads.append(threading.Thread(target=self.schedule_retries, name='email_sender_retries', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def enqueue(self, message, attempts=0):
+        """
+        Queues the EmailMessage and returns immediately. Raises queue.Full if the queue is full.
+        """
+        with self._condition:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((attempts, message))
+        except queue.Full:
+            self.done(1)
+            raise
+
+    def work(self):
+        """
+        Worker thread: sends the queued messages in batches of up to batch_size.
+        """
+        while not self._stopping.is_set():
+            try:
+                batch = [self._queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+
+            # Take whatever else is already queued, without waiting
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            attempts_by_message = {id(message): attempts for attempts, message in batch}
+            try:
+                failures = send_batch([message for _, message in batch], self.batch_size)
+            except Exception as e:
+                failures = [(message, e) for _, message in batch]
+
+            for message, error in failures:
+                self.retry(message, attempts_by_message[id(message)] + 1, error)
+
+            with self._condition:
+                self.sent_count += len(batch) - len(failures)
+            self.done(len(batch))
+
+    def retry(self, message, attempts, error):
+        """
+        Schedules another attempt to send the message, or gives up after EMAIL_MAX_ATTEMPTS attempts.
+        """
+        if attempts >= EMAIL_MAX_ATTEMPTS:
+            logger.error(f"Giving up sending email '{message.subject}' to {message.to} after {attempts} attempts: {error}")
+            with self._condition:
+                self.failed_count += 1
+            return
+
+        delay = get_retry_delay(attempts)
+        logger.warning(f"Failed to send email '{message.subject}' to {message.to}, retrying in {delay}s: {error}")
+        with self._condition:
+            self._pending += 1
+            self._sequence += 1
+            heapq.heappush(self._retries, (time.monotonic() + delay, self._sequence, attempts, message))
+            self._condition.notify_all()
+
+    def schedule_retries(self):
+        """
+        Retry thread: queues the messages again once their retry is due.
+        """
+        while not self._stopping.is_set():
+            with self._condition:
+                if not self._retries:
+                    self._condition.wait(1)
+                    continue
+                due_time, _, attempts, message = self._retries[0]
+                if due_time > time.monotonic():
+                    self._condition.wait(min(due_time - time.monotonic(), 1))
+                    continue
+                heapq.heappop(self._retries)
+
+            # Retries go back to the queue, blocking if it is full
+            self._queue.put((attempts, message))
+
+    def done(self, count):
+        with self._condition:
+            self._pending -= count
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued message was sent or given up on, including retries.
+        Returns False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self, timeout=EMAIL_QUEUE_SHUTDOWN_TIMEOUT):
+        """
+        Sends the queued messages (for up to timeout seconds), then stops the threads.
+        """
+        if not self.flush(timeout):
+            logger.error(f"Stopping the email queue with {self._pending} emails not sent.")
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+
+
+_email_queue = None
+_email_queue_lock = threading.Lock()
+
+
+def get_email_queue():
+    """
+    Returns the in-process email queue, starting its threads on first use.
+    """
+    global _email_queue
+    if _email_queue is None:
+        with _email_queue_lock:
+            if _email_queue is None:
+                _email_queue = EmailQueue()
+                # Don't lose the queued emails on a normal exit
+                atexit.register(_email_queue.stop)
+    return _email_queue
+
+
+def enqueue_email(subject, message, recipient_list, from_email=None, html_message=None):
+    """
+    Queues an email for sending and returns immediately.
+    """
+    enqueue_mass_email([(subject, message, from_email, recipient_list)], html_message=html_message)
+
+
+def enqueue_mass_email(datatuple, html_message=None):
+    """
+    Queues many emails for sending and returns immediately. datatuple is a sequence of
+    (subject, message, from_email, recipient_list) like for send_mass_mail(), each tuple
+    is sent as a separate email. With the in-process queue, queue.Full is raised once
+    EMAIL_QUEUE_MAXSIZE emails are waiting, the emails before were queued.
+    """
+    if EMAIL_USE_OUTBOX:
+        from common_django.email_sending_app.models import EmailOutbox
+        EmailOutbox.objects.bulk_create(
+            [
+                EmailOutbox(
+                    subject=subject,
+                    body=message,
+                    html_body=html_message,
+                    from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+                    recipients=list(recipient_list),
+                )
+                for subject, message, from_email, recipient_list in datatuple
+            ],
+            batch_size=1000,
+        )
+        return
+
+    email_queue = get_email_queue()
+    for subject, message, from_email, recipient_list in datatuple:
+        email_queue.enqueue(build_message(subject, message, recipient_list, from_email, html_message))
+
+
+def send_outbox(batch_size=None, limit=None):
+    """
+    Sends the pending EmailOutbox emails that are due, batch_size at a time over one connection.
+    Returns the number of emails sent.
+
+    Emails are claimed with SELECT ... FOR UPDATE SKIP LOCKED where the database supports it,
+    so several senders can drain the outbox concurrently. Failed emails are retried later with
+    an exponential backoff, up to EMAIL_MAX_ATTEMPTS attempts.
+    """
+    from common_django.email_sending_app.models import EmailOutbox
+
+    batch_size = batch_size or EMAIL_BATCH_SIZE
+    sent = 0
+    while limit is None or sent < limit:
+        with transaction.atomic():
+            # Emails left in the sending state past their deadline were claimed by a sender that died
+            due_emails = EmailOutbox.objects.filter(
+                status__in=[EmailOutbox.PENDING, EmailOutbox.SENDING],
+                next_attempt_at__lte=timezone.now(),
+            )
+            if connection.features.has_select_for_update_skip_locked:
+                due_emails = due_emails.select_for_update(skip_locked=True)
+            emails = list(due_emails.order_by('next_attempt_at')[:batch_size])
+            EmailOutbox.objects.filter(pk__in=[email.pk for email in emails]).update(
+                status=EmailOutbox.SENDING,
+                next_attempt_at=timezone.now() + timedelta(seconds=EMAIL_SENDING_TIMEOUT),
+            )
+
+        if not emails:
+            break
+
+        messages = {}
+        for email in emails:
+            messages[email.pk] = build_message(email.subject, email.body, email.recipients, email.from_email, email.html_body)
+        failures = {id(message): error for message, error in send_batch(list(messages.values()), batch_size)}
+
+        now = timezone.now()
+        sent_ids = []
+        for email in emails:
+            error = failures.get(id(messages[email.pk]))
+            if error is None:
+                sent_ids.append(email.pk)
+                continue
+
+            email.attempts += 1
+            email.last_error = str(error)
+            if email.attempts >= EMAIL_MAX_ATTEMPTS:
+                logger.error(f"Giving up sending outbox email {email.pk} after {email.attempts} attempts: {error}")
+                email.status = EmailOutbox.FAILED
+            else:
+                email.status = EmailOutbox.PENDING
+                email.next_attempt_at = now + timedelta(seconds=get_retry_delay(email.attempts))
+            email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+        EmailOutbox.objects.filter(pk__in=sent_ids).update(status=EmailOutbox.SENT, sent_at=now)
+        sent += len(sent_ids)
+
+    return sent
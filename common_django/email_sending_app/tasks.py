@@ -1,9 +1,12 @@
 from django.core.mail import send_mail
 from django.conf import settings
+# Queued sending, returning immediately (see sender.py)
+from common_django.email_sending_app.sender import enqueue_email, enqueue_mass_email, get_email_queue, send_outbox
 
 def send_email(subject, message, recipient_list):
     """
     Send an email using Django's send_mail function.
+    Blocks until the email is sent, use enqueue_email() for emails sent in the background.
 
     Args:
     - subject: The subject of the email.
@@ -0,0 +1,391 @@
+"""
+Benchmarks of the request logging hot paths, run with:
+
+    manage.py benchmark_request_logging [--output results.json]
+
+    middleware  overhead of SimpleLoggingMiddleware per request, for function and class based
+                views, anonymous and authenticated users, each log format and record mode
+    parse       log lines parsed per second by the LogProcessor, alone and through the
+                streaming pipeline, for each log format
+    ingest      rows stored per second by the LogProcessor, in a temporary SQLite database
+                (the database of the project is never written to)
+    memory      peak memory allocated by the pipeline and by the ingestion (in the temporary
+                database), with tracemalloc
+
+Log lines are generated synthetically with a fixed random seed, and every timing is the best
+of several repeats (the median for the middleware), so results can be compared run to run.
+Results are returned as a dict ready to be dumped as JSON.
+"""
+import io
+import sys
+import time
+import random
+import logging
+import platform
+import tempfile
+import tracemalloc
+from datetime import timedelta
+from functools import partial
+from statistics import median
+from contextlib import contextmanager
+import django
+from django.conf import settings
+from django.contrib.auth.models import User, AnonymousUser
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import path, resolve
+from django.utils.timezone import now
+from django.views import View
+from common_django.logging_app import formats, pipeline, log_processor
+from common_django.logging_app.log_processor import LogProcessor
+from common_django.logging_app.middleware import SimpleLoggingMiddleware
+from common_django.logging_app.models import RequestLog, RequestRollup, UserTrafficRollup, ViewMetadata
+
+# Seed of the synthetic log generator
+BENCHMARK_SEED = 42
+
+# Requests handled before timing the middleware
+BENCHMARK_WARMUP_REQUESTS = 200
+
+# Tables of the temporary database the ingestion is benchmarked against
+BENCHMARK_MODELS = (User, ViewMetadata, RequestLog, RequestRollup, UserTrafficRollup)
+
+
+def benchmark_function_view(request):
+    return HttpResponse('ok')
+
+
+class BenchmarkClassView(View):
+    def get(self, request):
+        return HttpResponse('ok')
+
+
+# URLs of the benchmarked views, resolved against this module only
+urlpatterns = [
+    path('benchmark/fbv/', benchmark_function_view, name='benchmark-fbv'),
+    path('benchmark/cbv/', BenchmarkClassView.as_view(), name='benchmark-cbv'),
+]
+
+
+def get_response(request):
+    """
+    Resolves and calls the view like Django's request handler does after the middleware.
+    """
+    resolver_match = resolve(request.path_info, urlconf=__name__)
+    request.resolver_match = resolver_match
+    return resolver_match.func(request, *resolver_match.args, **resolver_match.kwargs)
+
+
+def best_time(function, repeat):
+    """
+    Returns the shortest time (in seconds) taken by function() over repeat runs.
+    """
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def timed(function, argument):
+    """
+    Returns the time (in seconds) taken by function(argument).
+    """
+    start_time = time.perf_counter()
+    function(argument)
+    return time.perf_counter() - start_time
+
+
+class DiscardingHandler(logging.Handler):
+    """
+    Formats the records like a file handler would, then drops them.
+    """
+
+    def emit(self, record):
+        self.format(record)
+
+
+@contextmanager
+def discarded_request_logs():
+    """
+    Formats the request_logger records as usual but discards them instead of writing the log file.
+    """
+    request_logger = logging.getLogger('request_logger')
+    handler = DiscardingHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(module)s | %(levelname)s] %(message)s'))
+    saved = request_logger.handlers, request_logger.level, request_logger.propagate
+    request_logger.handlers, request_logger.level, request_logger.propagate = [handler], logging.INFO, False
+    try:
+        yield
+    finally:
+        request_logger.handlers, request_logger.level, request_logger.propagate = saved
+
+
+@contextmanager
+def temporary_database():
+    """
+    Replaces the default database by a temporary SQLite database with the tables of the ingestion,
+    so the benchmarks never write to (nor lock the rows of) the database of the project.
+    """
+    saved_settings = connections.settings[DEFAULT_DB_ALIAS]
+    saved_connection = connections[DEFAULT_DB_ALIAS]
+    with tempfile.TemporaryDirectory() as directory:
+        connections.settings[DEFAULT_DB_ALIAS] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': f'{directory}/benchmark.sqlite3'},
+        })[DEFAULT_DB_ALIAS]
+        connections[DEFAULT_DB_ALIAS] = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with connection.schema_editor() as schema_editor:
+                for model in BENCHMARK_MODELS:
+                    schema_editor.create_model(model)
+            yield
+        finally:
+            connections[DEFAULT_DB_ALIAS].close()
+            connections.settings[DEFAULT_DB_ALIAS] = saved_settings
+            connections[DEFAULT_DB_ALIAS] = saved_connection
+            # Forget the ids of the rows of the temporary database
+            log_processor.view_metadata_ids.clear()
+
+
+def benchmark_middleware(requests=2000, repeat=3):
+    """
+    Returns the overhead of the middleware per request, in microseconds, for every combination of
+    view type, user, log format and record mode. After a warm-up, every timed run through the
+    middleware follows a timed run of the views alone, and the median over the repeats is kept.
+    """
+    factory = RequestFactory()
+    users = {
+        'anonymous': AnonymousUser(),
+        'authenticated': User(id=1, username='benchmark', email='benchmark@example.com'),
+    }
+
+    def build_requests(url, user, count=requests):
+        built = []
+        for i in range(count):
+            request = factory.get(url, {'page': i % 10})
+            request.user = user
+            built.append(request)
+        return built
+
+    def handle_requests(handler, batch):
+        for request in batch:
+            handler(request)
+
+    results = []
+    with discarded_request_logs():
+        for view, url in (('fbv', '/benchmark/fbv/'), ('cbv', '/benchmark/cbv/')):
+            for user_kind, user in users.items():
+                for log_format in (formats.LEGACY_FORMAT, formats.JSON_FORMAT):
+                    for combined_record in (False, True):
+                        middleware = SimpleLoggingMiddleware(get_response)
+                        middleware.log_format = log_format
+                        middleware.combined_record = combined_record
+
+                        # Fill the caches (views, URL resolver, ...) before timing anything
+                        handle_requests(get_response, build_requests(url, user, BENCHMARK_WARMUP_REQUESTS))
+                        handle_requests(middleware, build_requests(url, user, BENCHMARK_WARMUP_REQUESTS))
+
+                        # Requests are built up front, only handling them is timed
+                        baselines = []
+                        timings = []
+                        for _ in range(repeat):
+                            baselines.append(timed(partial(handle_requests, get_response), build_requests(url, user)))
+                            timings.append(timed(partial(handle_requests, middleware), build_requests(url, user)))
+                        overhead = median(timing - baseline for timing, baseline in zip(timings, baselines))
+                        results.append({
+                            'view': view,
+                            'user': user_kind,
+                            'format': log_format,
+                            'record': 'combined' if combined_record else 'split',
+                            'requests': requests,
+                            'overhead_us_per_request': round(overhead / requests * 1e6, 2),
+                            'total_us_per_request': round(median(timings) / requests * 1e6, 2),
+                        })
+    return results
+
+
+def generate_log_lines(count, log_format, seed=BENCHMARK_SEED):
+    """
+    Returns count synthetic log lines in the given format, as written by the middleware
+    in combined record mode (every field of the request and its response).
+    """
+    rng = random.Random(seed)
+    middleware = SimpleLoggingMiddleware(get_response)
+    middleware.log_format = log_format
+    users = [User(id=i, username=f'user{i}', email=f'user{i}@example.com') for i in range(1, 51)]
+    views = [
+        {'app_name': 'shop', 'view': 'product-list', 'class_name': 'ProductListView', 'function_name': 'ProductListView.product-list', 'line_number': 42},
+        {'app_name': 'shop', 'view': 'product-detail', 'class_name': 'ProductDetailView', 'function_name': 'ProductDetailView.product-detail', 'line_number': 87},
+        {'app_name': 'accounts', 'view': 'profile', 'class_name': 'Unknown', 'function_name': 'profile', 'line_number': 12},
+    ]
+    timestamp = now()
+
+    lines = []
+    for i in range(count):
+        user = rng.choice(users) if rng.random() < 0.7 else AnonymousUser()
+        log_message = {
+            'timestamp': formats.format_timestamp(timestamp + timedelta(microseconds=i * 250)),
+            'method': 'GET',
+            'url': f'http://testserver/shop/products/?page={i}&sort={rng.choice(["name", "price"])}',
+            'remote_ip': f'10.0.{rng.randrange(256)}.{rng.randrange(256)}',
+            'request_params': {'page': str(i), 'sort': 'name'},
+            **rng.choice(views),
+            **middleware.build_log_user_fields(user),
+            'status_code': rng.choice((200, 200, 200, 302, 404, 500)),
+            'response_size': rng.randrange(200, 50000),
+            'duration_ms': round(rng.lognormvariate(3, 1), 3),
+            'cpu_ms': round(rng.lognormvariate(2, 1), 3),
+        }
+        lines.append(f"2024-10-04 07:19:00,000 [middleware | INFO] Access: {middleware.format_log_message(log_message)}\n")
+    return lines
+
+
+def benchmark_parse(lines=20000, repeat=3):
+    """
+    Returns the parse throughput, in lines per second, of the LogProcessor for each log format,
+    parsing lines one by one and streaming a whole file through the pipeline.
+    """
+    processor = LogProcessor()
+    results = []
+    for log_format in (formats.LEGACY_FORMAT, formats.JSON_FORMAT):
+        log_lines = generate_log_lines(lines, log_format)
+        log_file_data = ''.join(log_lines).encode('utf-8')
+
+        parse_time = best_time(lambda: [processor.parse_log(line) for line in log_lines], repeat)
+        pipeline_time = best_time(lambda: consume_pipeline(processor, log_file_data), repeat)
+        results.append({
+            'format': log_format,
+            'lines': lines,
+            'bytes': len(log_file_data),
+            'lines_per_sec': round(lines / parse_time),
+            'pipeline_lines_per_sec': round(lines / pipeline_time),
+        })
+    return results
+
+
+def consume_pipeline(processor, log_file_data, batch_size=500):
+    """
+    Streams the log file data through the pipeline, returns the number of parsed entries.
+    """
+    records = pipeline.parse_lines(pipeline.read_lines(io.BytesIO(log_file_data), 0), processor.parse_log)
+    return sum(len(batch) for batch, _, _ in pipeline.batched(records, batch_size))
+
+
+def benchmark_ingest(rows=5000, batch_size=500, repeat=3):
+    """
+    Returns the ingest throughput, in rows per second, of the LogProcessor for each log format.
+    Rows are stored in a transaction that is rolled back, so every repeat stores them anew.
+    """
+    processor = LogProcessor(batch_size=batch_size)
+    results = []
+    for log_format in (formats.LEGACY_FORMAT, formats.JSON_FORMAT):
+        log_data = [processor.parse_log(line) for line in generate_log_lines(rows, log_format)]
+        elapsed = min(timed(lambda entries: ingest_rolled_back(processor, entries), log_data) for _ in range(repeat))
+        results.append({
+            'format': log_format,
+            'rows': rows,
+            'batch_size': batch_size,
+            'rows_per_sec': round(rows / elapsed),
+        })
+    return results
+
+
+def ingest_rolled_back(processor, log_data, batch_size=None):
+    """
+    Stores the parsed log data with the LogProcessor in a transaction that is rolled back.
+    """
+    batch_size = batch_size or processor.batch_size
+    try:
+        with transaction.atomic():
+            for start in range(0, len(log_data), batch_size):
+                processor.save_logs_to_db(log_data[start:start + batch_size])
+            transaction.set_rollback(True)
+    finally:
+        # Forget the ids of the rolled back rows
+        log_processor.view_metadata_ids.clear()
+        processor.user_ids.clear()
+
+
+def benchmark_memory(lines=20000, batch_size=500):
+    """
+    Returns the peak memory (KiB) allocated while streaming a log file through the pipeline and
+    while ingesting it, for each log format.
+    """
+    processor = LogProcessor(batch_size=batch_size)
+    results = []
+    for log_format in (formats.LEGACY_FORMAT, formats.JSON_FORMAT):
+        # Read from a file like the LogProcessor does, so the file content isn't counted
+        with tempfile.TemporaryFile() as log_file:
+            log_file.writelines(line.encode('utf-8') for line in generate_log_lines(lines, log_format))
+            file_size = log_file.tell()
+
+            tracemalloc.start()
+            try:
+                log_file.seek(0)
+                records = pipeline.parse_lines(pipeline.read_lines(log_file, 0), processor.parse_log)
+                for batch, _, _ in pipeline.batched(records, batch_size):
+                    pass
+                _, pipeline_peak = tracemalloc.get_traced_memory()
+
+                tracemalloc.reset_peak()
+                log_file.seek(0)
+                records = pipeline.parse_lines(pipeline.read_lines(log_file, 0), processor.parse_log)
+                with transaction.atomic():
+                    for batch, _, _ in pipeline.batched(records, batch_size):
+                        processor.save_logs_to_db(batch)
+                    transaction.set_rollback(True)
+                _, ingest_peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                log_processor.view_metadata_ids.clear()
+                processor.user_ids.clear()
+
+        results.append({
+            'format': log_format,
+            'lines': lines,
+            'file_kib': round(file_size / 1024),
+            'pipeline_peak_kib': round(pipeline_peak / 1024),
+            'ingest_peak_kib': round(ingest_peak / 1024),
+        })
+    return results
+
+
+def benchmark_database(rows=5000, lines=20000, batch_size=500, repeat=3):
+    """
+    Runs the ingest and memory benchmarks against a temporary SQLite database.
+    """
+    with temporary_database():
+        return {
+            'ingest': benchmark_ingest(rows, batch_size, repeat),
+            'memory': benchmark_memory(lines, batch_size),
+        }
+
+
+def run_benchmarks(requests=2000, lines=20000, rows=5000, batch_size=500, repeat=3):
+    """
+    Runs all benchmarks and returns their results with a description of the environment.
+    """
+    # The benchmarks measure the logging code, not the logs of the log processor
+    log_processor_logger = logging.getLogger('log_processor')
+    saved_level = log_processor_logger.level
+    log_processor_logger.setLevel(logging.WARNING)
+    try:
+        # Requests are built for the host of the RequestFactory, whatever the hosts of the project
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            return {
+                'environment': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    # The ingestion is benchmarked in a temporary SQLite database
+                    'database': 'sqlite',
+                    'orjson': formats.orjson is not None,
+                    'platform': sys.platform,
+                },
+                'middleware': benchmark_middleware(requests, repeat),
+                'parse': benchmark_parse(lines, repeat),
+                **benchmark_database(rows, lines, batch_size, repeat),
+            }
+    finally:
+        log_processor_logger.setLevel(saved_level)
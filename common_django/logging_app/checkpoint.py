@@ -0,0 +1,206 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+# fcntl is only available on POSIX, elsewhere the checkpoint file is only locked between threads
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Logger shared with the log processor
+logger = logging.getLogger('log_processor')
+
+# Number of leading bytes used to fingerprint a log file
+HEAD_FINGERPRINT_SIZE = 128
+
+
+class CheckpointStore:
+    """
+    Persists how far each log file has been read so that the LogProcessor only
+    has to read the bytes appended since its previous run.
+
+    Every entry is keyed on the log file path and stores the byte offset reached
+    together with a fingerprint of the file (device, inode and a hash of its first
+    bytes). The fingerprint lets us detect a rotated or truncated file, in which
+    case reading starts again from the beginning, and lets a rotated (renamed,
+    copied or compressed) file resume from the checkpoint of the file it came from.
+
+    The store can be shared by threads and processes ingesting different files,
+    updates are serialized with a lock file.
+    """
+
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load all checkpoints from disk. A missing or corrupt file means no checkpoints.
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+
+        try:
+            with open(self.checkpoint_path, 'r') as checkpoint_file:
+                checkpoints = json.load(checkpoint_file)
+        except (IOError, ValueError) as e:
+            logger.error(f"Error reading checkpoint file {self.checkpoint_path}: {e}")
+            return {}
+
+        return checkpoints if isinstance(checkpoints, dict) else {}
+
+    def get(self, log_file_path):
+        """
+        Returns the stored checkpoint for the given log file, or None.
+        """
+        return self.load().get(str(log_file_path))
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds an exclusive lock on the checkpoint file, between threads and between processes.
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+
+            with open(f"{self.checkpoint_path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self, log_file_path, checkpoint):
+        """
+        Store the checkpoint for the given log file. The file is replaced atomically
+        so a crash while writing never leaves a half-written checkpoint behind.
+        """
+        with self.locked():
+            checkpoints = self.load()
+            checkpoints[str(log_file_path)] = checkpoint
+            self.write(checkpoints)
+
+    def prune(self):
+        """
+        Remove the checkpoints of log files that no longer exist (deleted rotated archives).
+        """
+        with self.locked():
+            checkpoints = self.load()
+            existing = {path: checkpoint for path, checkpoint in checkpoints.items() if os.path.exists(path)}
+            if len(existing) != len(checkpoints):
+                self.write(existing)
+
+    def write(self, checkpoints):
+        """
+        Replace all checkpoints on disk, to be called with the lock held.
+        """
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump(checkpoints, checkpoint_file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def resume_offset(self, log_file_path, log_file, compressed=False):
+        """
+        Returns the byte offset to resume reading the open (binary) log file from.
+
+        The checkpoint of the file itself is used if it still matches the file, otherwise
+        the checkpoint of another path matching it (the file was renamed, copied or compressed
+        by log rotation). Reading starts from 0 when no checkpoint matches: there is none yet,
+        the file was replaced (different leading bytes) or truncated (the file is now smaller
+        than the stored offset).
+
+        Offsets of compressed files are offsets in the decompressed content.
+        """
+        checkpoints = self.load()
+        stat = os.fstat(log_file.fileno())
+        heads = {}
+
+        checkpoint = checkpoints.get(str(log_file_path))
+        if checkpoint and self.matches(checkpoint, log_file, stat, compressed, heads):
+            return checkpoint.get('offset', 0)
+
+        for other_path, other_checkpoint in checkpoints.items():
+            if other_path != str(log_file_path) and self.matches(other_checkpoint, log_file, stat, compressed, heads):
+                logger.info(f"Log file {log_file_path} was rotated from {other_path}, resuming its checkpoint.")
+                return other_checkpoint.get('offset', 0)
+
+        if checkpoint:
+            logger.info(f"Log file {log_file_path} was rotated or truncated, reading from the start.")
+        return 0
+
+    def matches(self, checkpoint, log_file, stat, compressed, heads):
+        """
+        Returns True if the checkpoint was taken on the content of the open log file.
+        A checkpoint matches when its leading bytes match and either the file is the same
+        (device/inode) or enough leading bytes were fingerprinted to identify the content.
+        """
+        if not compressed and stat.st_size < checkpoint.get('offset', 0):
+            return False
+
+        same_file = (checkpoint.get('device'), checkpoint.get('inode')) == (stat.st_dev, stat.st_ino) and not compressed
+        head_size = checkpoint.get('head_size', 0)
+        if not same_file and head_size < HEAD_FINGERPRINT_SIZE:
+            return False
+
+        if head_size not in heads:
+            heads[head_size] = self.head_fingerprint(log_file, head_size)
+        return heads[head_size] == checkpoint.get('head')
+
+    def is_complete(self, log_file_path):
+        """
+        Returns True if the compressed archive was already read to the end and hasn't changed
+        since (same file, size and modification time), so it can be skipped without opening it.
+        Resuming a compressed file means decompressing it up to the checkpoint offset.
+        """
+        checkpoint = self.get(log_file_path)
+        if not checkpoint or not checkpoint.get('complete'):
+            return False
+
+        try:
+            stat = os.stat(log_file_path)
+        except OSError:
+            return False
+        return (
+            (checkpoint.get('device'), checkpoint.get('inode'), checkpoint.get('size'), checkpoint.get('mtime'))
+            == (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        )
+
+    def build_checkpoint(self, log_file, offset, heads=None, complete=False):
+        """
+        Builds the checkpoint for the open (binary) log file after reading up to offset.
+        Fingerprints are cached by size in heads, if given, as seeking back to the start
+        of a compressed file is expensive. The size and modification time are those of the
+        file on disk (compressed for archives), complete marks archives read to the end.
+        """
+        stat = os.fstat(log_file.fileno())
+        head_size = min(offset, HEAD_FINGERPRINT_SIZE)
+        heads = {} if heads is None else heads
+        if head_size not in heads:
+            heads[head_size] = self.head_fingerprint(log_file, head_size)
+        return {
+            'offset': offset,
+            'device': stat.st_dev,
+            'inode': stat.st_ino,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'head_size': head_size,
+            'head': heads[head_size],
+            'complete': complete,
+        }
+
+    def head_fingerprint(self, log_file, head_size):
+        """
+        Returns a hash of the first head_size bytes of the file, preserving the file position.
+        """
+        position = log_file.tell()
+        try:
+            log_file.seek(0)
+            return hashlib.sha1(log_file.read(head_size)).hexdigest()
+        finally:
+            log_file.seek(position)
@@ -0,0 +1,86 @@
+import json
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
+
+# orjson is optional, it is used for encoding and decoding when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Log record formats understood by the middleware and the log processor
+LEGACY_FORMAT = 'legacy'  # Python dict repr, parsed with ast.literal_eval
+JSON_FORMAT = 'json'  # One JSON object per log line
+
+# Second precision timestamps of the log files written before ISO 8601 timestamps, e.g. '2024-10-04 07:19:00 UTC'
+LEGACY_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+LEGACY_TIMESTAMP_SUFFIX = ' UTC'
+
+# Parsed legacy timestamps, many lines share the same second
+LEGACY_TIMESTAMP_CACHE_SIZE = 4096
+legacy_timestamps = {}
+
+
+def dumps(data):
+    """
+    Serialize the log data to a compact JSON string.
+    Values that aren't JSON serializable are rendered with str().
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode('utf-8')
+    return json.dumps(data, default=str, separators=(',', ':'))
+
+
+def loads(data):
+    """
+    Deserialize a JSON string produced by dumps().
+    Raises ValueError if the data isn't valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def is_json_record(log_line, log_start_idx):
+    """
+    Returns True if the record starting at log_start_idx is JSON rather than a dict repr.
+    JSON objects always start with a double-quoted key, dict reprs with a single-quoted one.
+    """
+    return log_line.startswith('{"', log_start_idx)
+
+
+def format_timestamp(value):
+    """
+    Returns the ISO 8601 representation of the datetime, with microseconds and UTC offset,
+    e.g. '2024-10-04T07:19:00.123456+00:00'.
+    """
+    return value.isoformat(timespec='microseconds')
+
+
+def parse_timestamp(value):
+    """
+    Returns the aware datetime of a logged timestamp, ISO 8601 or legacy. Naive ISO 8601
+    timestamps are in the default time zone. Raises ValueError if it can't be parsed.
+    """
+    if value.endswith(LEGACY_TIMESTAMP_SUFFIX):
+        return parse_legacy_timestamp(value)
+
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def parse_legacy_timestamp(value):
+    """
+    Returns the aware datetime of a legacy '%Y-%m-%d %H:%M:%S UTC' timestamp, memoized as
+    the lines logged in the same second share it.
+    """
+    timestamp = legacy_timestamps.get(value)
+    if timestamp is None:
+        timestamp = datetime.strptime(value[:-len(LEGACY_TIMESTAMP_SUFFIX)], LEGACY_TIMESTAMP_FORMAT)
+        timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+        if len(legacy_timestamps) >= LEGACY_TIMESTAMP_CACHE_SIZE:
+            legacy_timestamps.clear()
+        legacy_timestamps[value] = timestamp
+    return timestamp
@@ -0,0 +1,331 @@
+import os
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Overflow policies of the RequestLogQueueHandler when its queue is full
+OVERFLOW_DROP = 'drop'  # Drop new records while the queue is full
+OVERFLOW_BLOCK = 'block'  # Block the logging thread until there is room in the queue
+OVERFLOW_SAMPLE = 'sample'  # Only enqueue a sample of the records once the queue is half full
+OVERFLOW_POLICIES = (OVERFLOW_DROP, OVERFLOW_BLOCK, OVERFLOW_SAMPLE)
+
+
+class RequestLogQueueListener(QueueListener):
+    """
+    A QueueListener whose stop sentinel waits a bounded time for room in a full queue, instead
+    of raising queue.Full right away, since the queue of the RequestLogQueueHandler is bounded.
+    """
+
+    def __init__(self, queue, *handlers, respect_handler_level=False, timeout=5.0):
+        super().__init__(queue, *handlers, respect_handler_level=respect_handler_level)
+        self.timeout = timeout
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=self.timeout)
+
+
+class RequestLogQueueHandler(QueueHandler):
+    """
+    A logging handler that puts records on a bounded in-memory queue, a single background
+    thread then formats them and writes them to the target handler (a file by default).
+
+    This keeps formatting and disk I/O off the request threads. Use it in LOGGING in place
+    of the FileHandler of the request_logger (configured with '()' so that dictConfig doesn't
+    apply its own QueueHandler handling):
+
+        'request_logs_queue': {
+            '()': 'common_django.logging_app.handlers.RequestLogQueueHandler',
+            'filename': BASE_DIR / "logs/request_logs.log",
+            'formatter': 'default',
+            'maxsize': 10000,
+            'overflow': 'drop',
+        },
+    """
+
+    def __init__(self, filename=None, target=None, maxsize=10000, overflow=OVERFLOW_DROP, sample_rate=0.1,
+                 encoding=None):
+        """
+        :param filename: Log file written by the background thread, used when no target is given.
+        :param target: Handler the records are handed to by the background thread.
+        :param maxsize: Maximum number of records waiting in the queue.
+        :param overflow: What to do when the queue is full, 'drop', 'block' or 'sample'.
+        :param sample_rate: Fraction of the records kept by the 'sample' policy once the queue is half full.
+        :param encoding: Encoding of the log file.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}.")
+        if target is None and filename is None:
+            raise ValueError("Either a filename or a target handler is required.")
+
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = target if target is not None else logging.FileHandler(filename, encoding=encoding)
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.dropped_records = 0
+
+        self._listener = None
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        """
+        Records are formatted by the background thread, so the formatter goes to the target handler.
+        """
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Enqueue the record as it is, formatting is left to the background thread.
+        """
+        return record
+
+    def enqueue(self, record):
+        """
+        Put the record on the queue, applying the overflow policy when it is full.
+        """
+        self.start()
+
+        if self.overflow == OVERFLOW_BLOCK:
+            self.queue.put(record)
+            return
+
+        if self.overflow == OVERFLOW_SAMPLE and self.queue.qsize() * 2 >= self.queue.maxsize:
+            if random.random() >= self.sample_rate:
+                self.dropped_records += 1
+                return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+    def start(self):
+        """
+        Start the background writer thread, once per process so it survives a fork.
+        """
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener = RequestLogQueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._listener_pid = os.getpid()
+
+    def stop(self):
+        """
+        Write out the queued records and stop the background writer thread. If the queue stays
+        full (the writer is stuck), the queued records are dropped rather than blocking the exit.
+        """
+        with self._listener_lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                try:
+                    self._listener.stop()
+                except queue.Full:
+                    self.dropped_records += self.queue.qsize()
+            self._listener = None
+            self._listener_pid = None
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        super().close()
+
+
+class RequestLogDatabaseHandler(logging.Handler):
+    """
+    A logging handler that writes request log records straight to the RequestLog table, skipping
+    the round trip through the log file and the LogProcessor parsing.
+
+    The middleware attaches the structured record to every log record (record.log_data), which
+    is put on a bounded in-memory queue. A background thread bulk inserts the queued records
+    every batch_size records or flush_interval seconds, whichever comes first, reusing the
+    LogProcessor to build and store the entries (users, views, dedup keys and rollups).
+
+    Records are written to the fallback log file instead, formatted as usual, when the queue is
+    full or the database is unavailable, so the scheduled LogProcessor still ingests them later.
+    Use it in LOGGING in place of the FileHandler of the request_logger:
+
+        'request_logs_db': {
+            '()': 'common_django.logging_app.handlers.RequestLogDatabaseHandler',
+            'fallback_filename': BASE_DIR / "logs/request_logs.log",
+            'formatter': 'default',
+            'batch_size': 500,
+            'flush_interval': 2.0,
+            'maxsize': 10000,
+        },
+    """
+
+    # Put on the queue to stop the writer thread
+    STOP = object()
+
+    def __init__(self, fallback_filename=None, batch_size=500, flush_interval=2.0, maxsize=10000,
+                 retry_interval=30.0, encoding=None):
+        """
+        :param fallback_filename: Log file written when the records can't be stored in the database.
+        :param batch_size: Maximum number of records per bulk insert.
+        :param flush_interval: Maximum number of seconds a record waits before being stored.
+        :param maxsize: Maximum number of records waiting in the queue.
+        :param retry_interval: Seconds records go to the fallback file after a database error.
+        :param encoding: Encoding of the fallback log file.
+        """
+        super().__init__()
+        self.fallback = logging.FileHandler(fallback_filename, encoding=encoding, delay=True) if fallback_filename else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.fallback_records = 0
+        self.dropped_records = 0
+
+        # The database is skipped until this time after an error
+        self._retry_time = 0
+        self._processor = None
+        self._writer = None
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        """
+        The formatter is used for the records written to the fallback log file.
+        """
+        super().setFormatter(fmt)
+        if self.fallback is not None:
+            self.fallback.setFormatter(fmt)
+
+    def emit(self, record):
+        if getattr(record, 'log_data', None) is None:
+            # Not a record of the middleware, nothing to store
+            self.write_fallback([record])
+            return
+
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # The database can't keep up, keep the record in the file
+            self.write_fallback([record])
+
+    def start(self):
+        """
+        Start the background writer thread, once per process so it survives a fork.
+        """
+        if self._writer_pid == os.getpid():
+            return
+
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer = threading.Thread(target=self.run, name='request_log_db_writer', daemon=True)
+            self._writer.start()
+            self._writer_pid = os.getpid()
+
+    def run(self):
+        """
+        Writer thread: stores the queued records in batches until stopped.
+        """
+        stopping = False
+        while not stopping:
+            record = self.queue.get()
+            if record is self.STOP:
+                break
+
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if record is self.STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        """
+        Stores the records in the database, or writes them to the fallback file if it fails.
+        """
+        if time.monotonic() < self._retry_time:
+            self.write_fallback(batch)
+            return
+
+        # Imported here as handlers are configured before the apps are loaded
+        from django.db import close_old_connections
+        from common_django.logging_app.log_processor import LogProcessor
+
+        if self._processor is None:
+            self._processor = LogProcessor(batch_size=self.batch_size)
+        try:
+            # Raises unless the batch was stored (rejected rows aside), e.g. when the database is down
+            self._processor.save_logs_to_db([record.log_data for record in batch])
+        except Exception as e:
+            self._retry_time = time.monotonic() + self.retry_interval
+            logging.getLogger('log_processor').error(
+                f"Error storing {len(batch)} request logs, writing them to the fallback log file: {e}"
+            )
+            self.write_fallback(batch)
+        finally:
+            # Don't keep a broken or expired connection for the next batch
+            close_old_connections()
+
+    def write_fallback(self, records):
+        if self.fallback is None:
+            self.dropped_records += len(records)
+            return
+        for record in records:
+            self.fallback.handle(record)
+        self.fallback_records += len(records)
+
+    def stop(self):
+        """
+        Store the queued records and stop the background writer thread.
+        """
+        with self._writer_lock:
+            if self._writer is not None and self._writer_pid == os.getpid():
+                self.queue.put(self.STOP)
+                self._writer.join()
+            self._writer = None
+            self._writer_pid = None
+
+    def close(self):
+        self.stop()
+        if self.fallback is not None:
+            self.fallback.close()
+        super().close()
+
+
+# Serializes the wrapping of the logger handlers by queue_logger_handlers()
+_queue_handlers_lock = threading.Lock()
+
+
+def queue_logger_handlers(logger_name):
+    """
+    Replaces the handlers of the logger writing in the logging thread (e.g. a FileHandler) by
+    a RequestLogQueueHandler handing the records to them from a background thread, so logging
+    never blocks the caller on I/O. Returns the handlers that were wrapped.
+    Handlers that already queue their records are kept as they are.
+    """
+    logger = logging.getLogger(logger_name)
+    wrapped = []
+    with _queue_handlers_lock:
+        for handler in list(logger.handlers):
+            if isinstance(handler, (QueueHandler, RequestLogDatabaseHandler)):
+                continue
+            logger.removeHandler(handler)
+            logger.addHandler(RequestLogQueueHandler(target=handler))
+            wrapped.append(handler)
+    return wrapped
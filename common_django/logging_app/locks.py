@@ -0,0 +1,143 @@
+import os
+import logging
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+# fcntl is only available on POSIX, elsewhere the file lock can't be shared between processes
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Logger shared with the scheduler
+logger = logging.getLogger('log_scheduler')
+
+# How a single scheduler is elected: 'file' (one per host), 'database' (one per cluster,
+# PostgreSQL advisory lock) or None (every process runs its own scheduler)
+LOG_SCHEDULER_LOCK = getattr(settings, 'LOG_SCHEDULER_LOCK', 'file')
+LOG_SCHEDULER_LOCK_PATH = getattr(settings, 'LOG_SCHEDULER_LOCK_PATH', settings.BASE_DIR / 'logs/log_scheduler.lock')
+LOG_SCHEDULER_LOCK_KEY = getattr(settings, 'LOG_SCHEDULER_LOCK_KEY', 0x6c6f6773)  # 'logs'
+
+
+class FileLock:
+    """
+    An exclusive, non-blocking lock on a file, held until released or until the process exits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """
+        Returns True if the lock is held, taking it if it's free.
+        """
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            logger.warning("File locks aren't supported on this platform, the scheduler isn't exclusive.")
+            self._file = open(os.devnull, 'a')
+            return True
+
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class AdvisoryLock:
+    """
+    An exclusive, non-blocking PostgreSQL session advisory lock, shared by every host using the database.
+    The lock is held by a dedicated connection, so it's only released with release() or when the
+    connection is lost.
+    """
+
+    def __init__(self, key, using='default'):
+        self.key = key
+        self.using = using
+        self._connection = None
+
+    def acquire(self):
+        """
+        Returns True if the lock is held, taking it if it's free.
+        """
+        if self._connection is not None:
+            try:
+                with self._connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                return True
+            except Exception as e:
+                # The connection (and so the lock) was lost, try to take the lock again
+                logger.warning(f"Lost the scheduler lock connection: {e}")
+                self.release()
+
+        lock_connection = connections[self.using].copy()
+        try:
+            with lock_connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.key])
+                acquired = cursor.fetchone()[0]
+        except DatabaseError:
+            # Don't leak a connection per attempt while the database is unreachable
+            lock_connection.close()
+            raise
+
+        if not acquired:
+            lock_connection.close()
+            return False
+
+        self._connection = lock_connection
+        return True
+
+    def release(self):
+        if self._connection is None:
+            return
+        try:
+            with self._connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [self.key])
+        except Exception:
+            # Closing the connection releases the lock anyway
+            pass
+        finally:
+            self._connection.close()
+            self._connection = None
+
+
+class NoLock:
+    """
+    Always acquired, used when every process runs its own scheduler.
+    """
+
+    def acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+
+def get_scheduler_lock(kind=LOG_SCHEDULER_LOCK):
+    """
+    Returns the lock electing the process running the scheduler, as configured by LOG_SCHEDULER_LOCK.
+    """
+    if kind == 'database':
+        if connections['default'].vendor == 'postgresql':
+            return AdvisoryLock(LOG_SCHEDULER_LOCK_KEY)
+        logger.warning("Database scheduler locks need PostgreSQL, falling back to a file lock.")
+        kind = 'file'
+
+    if kind == 'file':
+        return FileLock(LOG_SCHEDULER_LOCK_PATH)
+
+    return NoLock()
@@ -1,17 +1,26 @@
 import os
+import time
+import glob
+import gzip
 import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
 import django
 from django.conf import settings
 from django.contrib.auth.models import User  # Import User model to handle user lookups
-from common_django.logging_app.models import RequestLog  # Adjust according to your project structure
+from common_django.logging_app.models import RequestLog, ViewMetadata  # Adjust according to your project structure
+from common_django.logging_app.checkpoint import CheckpointStore
+from common_django.logging_app import formats, pipeline, rollups
+from common_django.logging_app.metrics import get_metrics
+from common_django.logging_app.user_cache import UserIdCache, MISSING
 import ast
 import re
 from django.utils.functional import SimpleLazyObject
-# from django.db import IntegrityError
-import hashlib
 from django.utils import timezone
-from datetime import datetime
-import pytz
+from django.db import transaction, connections, DatabaseError, DataError, IntegrityError
+from django.db.models import Q
+from urllib.parse import urlsplit, parse_qsl
 
 # # Setup Django if not already done
 # def setup_django():
@@ -25,44 +34,273 @@ logger = logging.getLogger('log_processor')
 # Path to the log file you wish to read
 LOG_FILE_PATH = settings.BASE_DIR / 'logs/request_logs.log'
 
-print('Log file path:', LOG_FILE_PATH)
+# Log files to ingest, paths or glob patterns (e.g. one file per gunicorn worker or host)
+LOG_FILE_PATHS = getattr(settings, 'LOG_FILE_PATHS', [LOG_FILE_PATH])
+
+# Also ingest rotated archives of the log files (request_logs.log.1, request_logs.log.2.gz, ...)
+LOG_INCLUDE_ROTATED = getattr(settings, 'LOG_INCLUDE_ROTATED', True)
+
+# Number of log files ingested concurrently, and whether they are ingested by threads or processes
+LOG_INGEST_WORKERS = getattr(settings, 'LOG_INGEST_WORKERS', 1)
+LOG_INGEST_POOL = getattr(settings, 'LOG_INGEST_POOL', 'thread')
+
+# File recording how far each log file has already been read
+LOG_CHECKPOINT_PATH = getattr(settings, 'LOG_CHECKPOINT_PATH', settings.BASE_DIR / 'logs/request_logs.checkpoint.json')
+
+# On the first run, without checkpoint file, mark the existing log files as read if request logs are already
+# stored: they were ingested by a version without checkpoints and would otherwise be stored twice
+LOG_SEED_CHECKPOINTS = getattr(settings, 'LOG_SEED_CHECKPOINTS', True)
+
+# Number of log entries written per bulk insert, 1 saves entries one by one
+LOG_BATCH_SIZE = getattr(settings, 'LOG_BATCH_SIZE', 500)
+
+# Email to user id cache, kept across runs (for LOG_USER_CACHE_TTL seconds) when a TTL is configured
+LOG_USER_CACHE_SIZE = getattr(settings, 'LOG_USER_CACHE_SIZE', 10000)
+LOG_USER_CACHE_TTL = getattr(settings, 'LOG_USER_CACHE_TTL', None)
+shared_user_id_cache = UserIdCache(LOG_USER_CACHE_SIZE, LOG_USER_CACHE_TTL) if LOG_USER_CACHE_TTL else None
+
+# Fields identifying a ViewMetadata row, and the ids of the rows already looked up by this process
+VIEW_METADATA_FIELDS = ('app_name', 'view', 'class_name', 'function_name', 'line_number')
+view_metadata_ids = {}
+
+# Seconds between checkpoint saves while a log file is being ingested
+CHECKPOINT_INTERVAL = 1.0
+
+# Suffixes added by log rotation: numbered (logrotate, RotatingFileHandler) or dated
+# (TimedRotatingFileHandler) archives, optionally compressed
+ROTATED_SUFFIX_RE = re.compile(r'\.(\d+|\d{4}-\d{2}-\d{2}(_\d{2}(-\d{2}){0,2})?)(\.gz)?$|\.gz$')
+
+logger.debug(f"Log file paths: {LOG_FILE_PATHS}")
+
+
+def process_log_file_in_worker(checkpoint_path, batch_size, log_file_path):
+    """
+    Ingests a single log file in a worker process of the LogProcessor.
+    """
+    try:
+        return LogProcessor(log_file_path, checkpoint_path, batch_size, workers=1).process_log_file(log_file_path)
+    finally:
+        connections.close_all()
 
 
 class LogProcessor:
-    def __init__(self, log_file_path=LOG_FILE_PATH):
+    def __init__(self, log_file_path=LOG_FILE_PATHS, checkpoint_path=LOG_CHECKPOINT_PATH, batch_size=LOG_BATCH_SIZE,
+                 workers=LOG_INGEST_WORKERS, pool=LOG_INGEST_POOL, include_rotated=LOG_INCLUDE_ROTATED,
+                 seed_checkpoints=LOG_SEED_CHECKPOINTS):
+        """
+        :param log_file_path: Log file path or glob pattern, or a list of them.
+        :param checkpoint_path: File recording how far each log file has been read.
+        :param batch_size: Number of log entries written per bulk insert, 1 saves entries one by one.
+        :param workers: Number of log files ingested concurrently.
+        :param pool: 'thread' or 'process', how log files are ingested concurrently.
+        :param include_rotated: Also ingest the rotated archives of the log files.
+        :param seed_checkpoints: On the first run, mark the existing log files as read if request logs are already stored.
+        """
         self.log_file_path = log_file_path
+        self.batch_size = batch_size or 1
+        self.workers = workers or 1
+        self.pool = pool
+        self.include_rotated = include_rotated
+        self.seed_checkpoints_on_first_run = seed_checkpoints
+        self.checkpoints = CheckpointStore(checkpoint_path)
+        self.user_ids = UserIdCache(LOG_USER_CACHE_SIZE)
         # setup_django()  # Ensure Django is set up before processing logs
 
+    def get_log_files(self):
+        """
+        Returns the existing log files to ingest, oldest first, expanding glob patterns
+        and adding rotated archives of the log files.
+        """
+        if isinstance(self.log_file_path, (str, os.PathLike)):
+            patterns = [self.log_file_path]
+        else:
+            patterns = list(self.log_file_path)
+
+        # Never pick up the files of the checkpoint store through a glob pattern
+        checkpoint_path = str(self.checkpoints.checkpoint_path)
+        ignored_paths = {checkpoint_path, f"{checkpoint_path}.tmp", f"{checkpoint_path}.lock"}
+
+        log_files = set()
+        for pattern in patterns:
+            pattern = str(pattern)
+            if not any(char in pattern for char in '*?['):
+                pattern = glob.escape(pattern)
+
+            log_files.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+            if self.include_rotated:
+                # Archives are found even when the log file they were rotated from is gone
+                rotated_paths = glob.glob(f"{pattern}.*")
+                log_files.update(path for path in rotated_paths if ROTATED_SUFFIX_RE.search(path) and os.path.isfile(path))
+
+        log_files -= ignored_paths
+
+        # Rotation can remove (rename or compress) a file after it was listed, skip the vanished ones
+        modification_times = {}
+        for path in log_files:
+            try:
+                modification_times[path] = os.path.getmtime(path)
+            except OSError:
+                logger.debug(f"Log file {path} vanished while listing the log files.")
+        return sorted(modification_times, key=lambda path: (modification_times[path], path))
+
     def process_logs(self):
         """
-        Reads and processes logs from the log file and saves entries to the database.
+        Reads the lines appended to the log files since the previous run and saves entries to the database.
         """
-        if not os.path.exists(self.log_file_path):
-            logger.warning(f"Log file does not exist at {self.log_file_path}.")
+        log_files = self.get_log_files()
+        if not log_files:
+            logger.warning(f"No log file exists at {self.log_file_path}.")
             return
 
+        if (self.seed_checkpoints_on_first_run and not os.path.exists(self.checkpoints.checkpoint_path)
+                and RequestLog.objects.exists()):
+            # Upgrade from a version without checkpoints, the existing lines are already stored
+            logger.warning(
+                f"No checkpoint file at {self.checkpoints.checkpoint_path} but request logs are already stored, "
+                f"marking the existing log files as read instead of ingesting them again."
+            )
+            self.seed_checkpoints(log_files)
+
+        # Users are looked up once per run, or once per TTL with the shared cache
+        self.user_ids = shared_user_id_cache or UserIdCache(LOG_USER_CACHE_SIZE)
+
+        if self.workers > 1 and len(log_files) > 1:
+            self.process_log_files_concurrently(log_files)
+        else:
+            for log_file_path in log_files:
+                self.process_log_file(log_file_path)
+
+        # Rotated files have taken over the checkpoints of the files they were rotated from
+        self.checkpoints.prune()
+
+    def seed_checkpoints(self, log_files=None):
+        """
+        Marks the log files without checkpoint as read up to their last complete line, without
+        storing their entries. Returns the list of the seeded log files.
+        """
+        seeded = []
+        for log_file_path in self.get_log_files() if log_files is None else log_files:
+            if self.checkpoints.get(log_file_path) is not None:
+                continue
+
+            compressed = str(log_file_path).endswith('.gz')
+            try:
+                with (gzip.open(log_file_path, 'rb') if compressed else open(log_file_path, 'rb')) as log_file:
+                    # Offset just past the last complete line, a line still being written is read later
+                    offset = 0
+                    for _, offset in pipeline.read_lines(log_file, 0):
+                        pass
+                    self.checkpoints.save(
+                        log_file_path, self.checkpoints.build_checkpoint(log_file, offset, complete=compressed)
+                    )
+            except (IOError, EOFError) as e:
+                logger.error(f"Error reading log file {log_file_path}: {e}")
+                continue
+
+            logger.info(f"Marked {log_file_path} as read up to offset {offset}.")
+            seeded.append(log_file_path)
+        return seeded
+
+    def process_log_files_concurrently(self, log_files):
+        """
+        Ingests the log files with a pool of threads or processes, each file keeps its own checkpoint.
+        """
+        if self.pool == 'process':
+            # Forked workers must not share the database connections of this process
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+            worker = partial(process_log_file_in_worker, self.checkpoints.checkpoint_path, self.batch_size)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            worker = self.process_log_file_in_thread
+
+        with executor:
+            for log_file_path, processed in zip(log_files, executor.map(worker, log_files)):
+                logger.info(f"Processed {processed} lines of {log_file_path}.")
+
+    def process_log_file_in_thread(self, log_file_path):
+        """
+        Ingests a single log file in a worker thread, closing the database connections of the thread afterwards.
+        """
         try:
-            with open(self.log_file_path, 'r') as log_file:
-                log_lines = log_file.readlines()
-
-            if not log_lines:
-                logger.info("No new logs to process.")
-                return
-
-            # Process each log entry
-            for log_line in log_lines:
-                log_data = self.parse_log(log_line)
-                if log_data:
-                    # Save the log entry to the database
-                    self.save_log_to_db(log_data)
-        except IOError as e:
-            logger.error(f"Error reading log file {self.log_file_path}: {e}")
+            return self.process_log_file(log_file_path)
+        finally:
+            connections.close_all()
+
+    def process_log_file(self, log_file_path):
+        """
+        Reads the lines appended to the log file since the previous run and saves entries to the database.
+        Returns the number of lines read.
+        """
+        processed = 0
+        compressed = str(log_file_path).endswith('.gz')
+        metrics = get_metrics()
+        if compressed and self.checkpoints.is_complete(log_file_path):
+            # Archives don't change once rotated, a fully read one has nothing new
+            logger.debug(f"Log file {log_file_path} was already read to the end.")
+            return processed
+
+        try:
+            with (gzip.open(log_file_path, 'rb') if compressed else open(log_file_path, 'rb')) as log_file:
+                # Resume from the stored checkpoint instead of re-reading the whole file
+                offset = self.checkpoints.resume_offset(log_file_path, log_file, compressed)
+                log_file.seek(offset)
+
+                # Offset up to which every entry has been written to the database
+                committed_offset = offset
+                last_checkpoint_time = time.monotonic()
+                heads = {}
+                complete = False
+                try:
+                    # Stream the file through the pipeline, memory is bounded by the batch size
+                    lines = pipeline.read_lines(log_file, offset)
+                    records = pipeline.parse_lines(lines, self.parse_log)
+                    for batch, batch_offset, line_count in pipeline.batched(records, self.batch_size):
+                        metrics.inc('request_log_lines_read_total', line_count)
+                        metrics.inc('request_log_lines_parsed_total', len(batch))
+                        metrics.inc('request_log_lines_failed_total', line_count - len(batch))
+
+                        batch_start_time = time.perf_counter()
+                        if self.batch_size > 1:
+                            self.save_logs_to_db(batch)
+                        else:
+                            for log_data in batch:
+                                # Save the log entry to the database
+                                self.save_log_to_db(log_data)
+                        metrics.observe('request_log_batch_seconds', time.perf_counter() - batch_start_time)
+
+                        processed += line_count
+                        committed_offset = batch_offset
+
+                        # Persist progress regularly so a crash doesn't re-read the whole backlog
+                        if time.monotonic() - last_checkpoint_time >= CHECKPOINT_INTERVAL:
+                            self.checkpoints.save(log_file_path, self.checkpoints.build_checkpoint(log_file, committed_offset, heads))
+                            last_checkpoint_time = time.monotonic()
+
+                    # Compressed archives are complete once read to the end
+                    complete = compressed
+                finally:
+                    # Persist progress even if processing stopped half way
+                    self.checkpoints.save(
+                        log_file_path, self.checkpoints.build_checkpoint(log_file, committed_offset, heads, complete)
+                    )
+                    if not compressed:
+                        # Compressed archives are complete, only live files can fall behind
+                        metrics.set('request_log_bytes_behind', os.fstat(log_file.fileno()).st_size - committed_offset, file=str(log_file_path))
+
+            if not processed:
+                logger.debug(f"No new logs to process in {log_file_path}.")
+        except (IOError, EOFError) as e:
+            logger.error(f"Error reading log file {log_file_path}: {e}")
         except Exception as e:
-            logger.error(f"Unexpected error while processing logs: {e}")
+            logger.error(f"Unexpected error while processing logs of {log_file_path}: {e}")
+
+        return processed
 
     def parse_log(self, log_line):
         """
         Parse the log line and extract relevant details.
+        Both JSON records and legacy dict repr records are supported.
         """
         try:
             # Extract the part after "Request:" or "Response:" and ensure it's properly formatted
@@ -73,14 +311,18 @@ class LogProcessor:
 
             log_data_str = log_line[log_start_idx:]  # Extract the string containing the dictionary
 
-            # Handle potential issues with quotes and Django-specific objects
-            log_data_str = self.preprocess_log_data(log_data_str)
+            if formats.is_json_record(log_line, log_start_idx):
+                # JSON records (LOG_FORMAT = 'json') are decoded directly
+                log_data = formats.loads(log_data_str)
+            else:
+                # Handle potential issues with quotes and Django-specific objects
+                log_data_str = self.preprocess_log_data(log_data_str)
 
-            # Use ast.literal_eval to safely parse the dictionary string into a Python dictionary
-            log_data = ast.literal_eval(log_data_str)
+                # Use ast.literal_eval to safely parse the dictionary string into a Python dictionary
+                log_data = ast.literal_eval(log_data_str)
 
-            # Handle Django-specific objects, like SimpleLazyObject
-            log_data = self.clean_log_data(log_data)
+                # Handle Django-specific objects, like SimpleLazyObject
+                log_data = self.clean_log_data(log_data)
 
             # Check that the log data has the required fields
             required_fields = ['timestamp', 'url', 'method', 'user', 'remote_ip', 'app_name', 'view', 'class_name', 'function_name', 'line_number']
@@ -137,59 +379,302 @@ class LogProcessor:
         # Return the cleaned log data
         return log_data
 
+    def build_log_entry(self, log_data):
+        """
+        Build an unsaved RequestLog instance from the parsed log data.
+        Returns None if the entry can't be stored.
+        """
+        # Records carry the user id, older legacy records only the user email
+        if 'user_id' in log_data:
+            user_id = log_data['user_id']
+            if user_id is not None and not log_data.get('user'):
+                # Only read from the session by the middleware, the user may have been deleted since
+                user_id = self.get_existing_user_id(user_id)
+        else:
+            user_id = self.get_user_id(log_data.get('user'))
+
+        # ISO 8601 timestamps, or the legacy second precision ones of older log files
+        timestamp_str = log_data.get('timestamp', '')
+        try:
+            timestamp = formats.parse_timestamp(timestamp_str)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Invalid timestamp format: {timestamp_str}. Error: {e}")
+            return None  # Skip saving this entry
+
+        # Only the host and path of the URL are stored, the query string is in the request params
+        split_url = urlsplit(log_data.get('url') or '')
+        request_params = log_data.get('request_params')
+        if request_params is None and split_url.query:
+            # Response records don't log the params, keep those of the query string
+            request_params = dict(parse_qsl(split_url.query, keep_blank_values=True))
+
+        # Save log data to the database
+        log_data_to_save = {
+            'timestamp': timestamp,
+            'method': log_data.get('method'),
+            'host': split_url.netloc[:255],
+            'path': split_url.path[:2048],
+            'remote_ip': log_data.get('remote_ip'),
+            'request_params': request_params,
+            'view_metadata_id': self.get_view_metadata_id(log_data),
+            'user_id': user_id,  # Set the foreign key by id, no User instance is loaded
+            'status_code': log_data.get('status_code'),
+            'response_size': log_data.get('response_size'),
+            'duration_ms': log_data.get('duration_ms'),
+            'cpu_ms': log_data.get('cpu_ms'),
+            'sql_count': log_data.get('sql_count'),
+            'sql_time_ms': log_data.get('sql_time_ms'),
+            'profile': log_data.get('profile'),
+        }
+
+        log_entry = RequestLog(**log_data_to_save)
+        # The dedup key covers the request params, so URLs differing only by their query string don't collide
+        log_entry.log_key = log_entry.compute_log_key()
+        return log_entry
+
+    def get_user_id(self, email):
+        """
+        Returns the id of the user with the given email, or None.
+        """
+        if not email:
+            return None
+
+        user_id = self.user_ids.get(email)
+        if user_id is MISSING:
+            user_id = self.resolve_user_ids([email])[email]
+        return user_id
+
+    def resolve_user_ids(self, emails):
+        """
+        Returns a dict of user ids (or None) by email, looking up all uncached emails with a single query.
+        """
+        user_ids = {}
+        missing_emails = set()
+        for email in emails:
+            if not email or email in user_ids:
+                continue
+            user_id = self.user_ids.get(email)
+            if user_id is MISSING:
+                missing_emails.add(email)
+            else:
+                user_ids[email] = user_id
+
+        if missing_emails:
+            # Ordered by descending id so the lowest id wins for duplicate emails, like .first()
+            found = dict(User.objects.filter(email__in=missing_emails).order_by('-id').values_list('email', 'id'))
+            for email in missing_emails:
+                user_ids[email] = found.get(email)
+                self.user_ids.set(email, user_ids[email])
+
+        return user_ids
+
+    def get_existing_user_id(self, user_id):
+        """
+        Returns the user id if the user exists, or None.
+        """
+        existing_user_id = self.user_ids.get(user_id)
+        if existing_user_id is MISSING:
+            existing_user_id = self.resolve_existing_user_ids([user_id])[user_id]
+        return existing_user_id
+
+    def resolve_existing_user_ids(self, user_ids):
+        """
+        Returns a dict of the user ids, or None for the users that don't exist, checking all
+        uncached ids with a single query. They're cached by id along with the emails.
+        """
+        existing_user_ids = {}
+        missing_user_ids = set()
+        for user_id in user_ids:
+            if user_id is None or user_id in existing_user_ids:
+                continue
+            existing_user_id = self.user_ids.get(user_id)
+            if existing_user_id is MISSING:
+                missing_user_ids.add(user_id)
+            else:
+                existing_user_ids[user_id] = existing_user_id
+
+        if missing_user_ids:
+            found = set(User.objects.filter(id__in=missing_user_ids).values_list('id', flat=True))
+            for user_id in missing_user_ids:
+                existing_user_ids[user_id] = user_id if user_id in found else None
+                self.user_ids.set(user_id, existing_user_ids[user_id])
+
+        return existing_user_ids
+
+    def get_view_metadata_key(self, log_data):
+        """
+        Returns the values of the ViewMetadata fields for the parsed log data.
+        """
+        line_number = log_data.get('line_number')
+        return (
+            log_data.get('app_name', 'Unknown'),
+            log_data.get('view', 'Unknown'),
+            log_data.get('class_name', 'Unknown'),
+            log_data.get('function_name', 'Unknown'),
+            int(line_number) if str(line_number).isdigit() else None,
+        )
+
+    def get_view_metadata_id(self, log_data):
+        """
+        Returns the id of the ViewMetadata row for the view of the parsed log data, creating it if needed.
+        """
+        key = self.get_view_metadata_key(log_data)
+        view_metadata_id = view_metadata_ids.get(key)
+        if view_metadata_id is None:
+            view_metadata_id = self.resolve_view_metadata_ids([key])[key]
+        return view_metadata_id
+
+    def resolve_view_metadata_ids(self, keys):
+        """
+        Returns a dict of ViewMetadata ids by key, looking up and creating all unknown views at once.
+        """
+        missing_keys = {key for key in keys if key not in view_metadata_ids}
+        if missing_keys:
+            self.load_view_metadata_ids(missing_keys)
+
+            # Unique constraints don't apply to NULL line numbers, so only create rows that don't exist
+            new_keys = missing_keys - view_metadata_ids.keys()
+            if new_keys:
+                ViewMetadata.objects.bulk_create(
+                    [ViewMetadata(**dict(zip(VIEW_METADATA_FIELDS, key))) for key in new_keys],
+                    ignore_conflicts=True,
+                )
+                self.load_view_metadata_ids(new_keys)
+
+        return {key: view_metadata_ids.get(key) for key in keys}
+
+    def load_view_metadata_ids(self, keys):
+        """
+        Loads the ids of the existing ViewMetadata rows with the given keys.
+        """
+        condition = Q()
+        for key in keys:
+            condition |= Q(**dict(zip(VIEW_METADATA_FIELDS, key)))
+        for view_metadata_id, *key in ViewMetadata.objects.filter(condition).values_list('id', *VIEW_METADATA_FIELDS):
+            view_metadata_ids.setdefault(tuple(key), view_metadata_id)
+
     def save_log_to_db(self, log_data):
         """
         Save the log data to the RequestLog model in the database.
+        Returns False if the entry can't be stored. Database errors other than a rejected row
+        (e.g. a lost connection) are raised, so the file isn't read past the entry.
         """
+        metrics = get_metrics()
         try:
-            # Ensure the 'user' field is a valid User instance or None
-            user = log_data.get('user')
-            if user:
-                user_instance = User.objects.filter(email=user).first()
-            else:
-                user_instance = None
+            log_entry = self.build_log_entry(log_data)
+            if log_entry is None:
+                metrics.inc('request_log_lines_failed_total')
+                return False
 
-            # Parse the timestamp correctly
-            timestamp_str = log_data.get('timestamp', '')
             try:
-                # Remove the 'UTC' and convert the string to a valid datetime object
-                if 'UTC' in timestamp_str:
-                    timestamp_str = timestamp_str.replace(' UTC', '')
-                timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                # Assign the timestamp to the UTC timezone
-                timestamp = timezone.make_aware(timestamp, pytz.UTC)
-            except ValueError as e:
-                logger.error(f"Invalid timestamp format: {timestamp_str}. Error: {e}")
-                return  # Skip saving this entry
-
-            # Save log data to the database
-            log_data_to_save = {
-                'timestamp': timestamp,
-                'method': log_data.get('method'),
-                'url': log_data.get('url'),
-                'remote_ip': log_data.get('remote_ip'),
-                'request_params': log_data.get('request_params'),
-                'app_name': log_data.get('app_name', 'Unknown'),
-                'view': log_data.get('view', 'Unknown'),
-                'class_name': log_data.get('class_name', 'Unknown'),
-                'function_name': log_data.get('function_name', 'Unknown'),
-                'line_number': log_data.get('line_number', 'Unknown'),
-                'user': user_instance,  # Use the actual User instance if found
-            }
-
-            # Generate a hash for the log entry to prevent duplicates
-            log_hash = hashlib.sha256(str(log_data_to_save).encode('utf-8')).hexdigest()
-
-            # Check for duplicate entry before saving
-            if not RequestLog.objects.filter(log_hash=log_hash).exists():
-                # Create a new log entry in the database
-                RequestLog.objects.create(**log_data_to_save, log_hash=log_hash)
-                logger.info(f"Processed log entry: {log_data_to_save['timestamp']}")
+                # In its own transaction (a savepoint within a batch), so a bad row doesn't break the others
+                with transaction.atomic():
+                    # Check for duplicate entry before saving
+                    duplicate = RequestLog.objects.filter(log_key=log_entry.log_key).exists()
+                    if not duplicate:
+                        # Create a new log entry in the database, counted in the rollups in the same transaction
+                        log_entry.save()
+                        rollups.update_rollups([log_entry])
+            except IntegrityError:
+                # Stored concurrently by another ingester since the check
+                duplicate = RequestLog.objects.filter(log_key=log_entry.log_key).exists()
+                if not duplicate:
+                    raise
+            if duplicate:
+                metrics.inc('request_log_duplicates_total')
             else:
-                logger.info(f"Duplicate log entry found for {log_data_to_save['timestamp']}")
+                metrics.inc('request_log_rows_written_total')
+                self.report_lag(log_entry.timestamp)
+            return True
 
+        except (IntegrityError, DataError) as e:
+            metrics.inc('request_log_lines_failed_total')
+            logger.error(f"Error saving log entry to database: {e} (Log Data: {log_data})")
+            return False
+        except DatabaseError:
+            raise
         except Exception as e:
+            metrics.inc('request_log_lines_failed_total')
             logger.error(f"Error saving log entry to database: {e} (Log Data: {log_data})")
+            return False
+
+    def save_logs_to_db(self, log_data_batch):
+        """
+        Save a batch of log data to the RequestLog model with a single bulk insert.
+        Duplicates are skipped through the unique log_key. Database errors are raised, except
+        for rejected rows, so the file isn't read past a batch that wasn't stored.
+        """
+        # Look up the users of the whole batch at once
+        self.resolve_user_ids([log_data.get('user') for log_data in log_data_batch if 'user_id' not in log_data])
+        self.resolve_existing_user_ids([
+            log_data['user_id'] for log_data in log_data_batch if 'user_id' in log_data and not log_data.get('user')
+        ])
+        self.resolve_view_metadata_ids([self.get_view_metadata_key(log_data) for log_data in log_data_batch])
+
+        log_entries = []
+        built_log_data = []
+        for log_data in log_data_batch:
+            try:
+                log_entry = self.build_log_entry(log_data)
+            except DatabaseError:
+                raise
+            except Exception as e:
+                logger.error(f"Error building log entry: {e} (Log Data: {log_data})")
+                continue
+            if log_entry is not None:
+                log_entries.append(log_entry)
+                built_log_data.append(log_data)
+
+        metrics = get_metrics()
+        # Entries with an invalid timestamp or that couldn't be built
+        metrics.inc('request_log_lines_failed_total', len(log_data_batch) - len(log_entries))
+        if not log_entries:
+            return
+
+        newest_timestamp = max(log_entry.timestamp for log_entry in log_entries)
+        try:
+            with transaction.atomic():
+                # Duplicates (e.g. a file read again) are looked up for the whole batch with one query,
+                # so they're neither inserted nor counted in the rollups
+                new_log_entries = self.get_new_log_entries(log_entries)
+                # Every entry is inserted or the batch fails, so the rollups count exactly the inserted rows
+                RequestLog.objects.bulk_create(new_log_entries, batch_size=self.batch_size)
+                rollups.update_rollups(new_log_entries)
+        except (IntegrityError, DataError) as e:
+            # A single bad row (e.g. a value the column type rejects) or an entry stored concurrently by
+            # another ingester fails the whole insert, save the entries one by one so only the bad rows
+            # are skipped, duplicates are counted as such and the file is still read past them
+            logger.warning(f"Error saving batch of {len(log_entries)} log entries, saving them one by one: {e}")
+            saved = [self.save_log_to_db(log_data) for log_data in built_log_data]
+            if not any(saved):
+                # Not a few bad rows, keep the batch to be retried
+                raise
+            return
+        metrics.inc('request_log_duplicates_total', len(log_entries) - len(new_log_entries))
+        metrics.inc('request_log_rows_written_total', len(new_log_entries))
+        self.report_lag(newest_timestamp)
+        logger.debug(f"Processed batch of {len(log_entries)} log entries up to {log_entries[-1].timestamp}")
+
+    def report_lag(self, newest_timestamp):
+        """
+        Reports the delay between the logged time of the newest stored entry and now.
+        """
+        get_metrics().set('request_log_lag_seconds', (timezone.now() - newest_timestamp).total_seconds())
+
+    def get_new_log_entries(self, log_entries):
+        """
+        Returns the log entries whose log_key isn't stored yet, without duplicates.
+        """
+        stored_keys = set(
+            RequestLog.objects.filter(log_key__in=[log_entry.log_key for log_entry in log_entries])
+            .values_list('log_key', flat=True)
+        )
+        new_log_entries = []
+        for log_entry in log_entries:
+            if log_entry.log_key not in stored_keys:
+                stored_keys.add(log_entry.log_key)
+                new_log_entries.append(log_entry)
+        return new_log_entries
 
     def run(self):
         """
@@ -0,0 +1,30 @@
+import json
+from django.core.management.base import BaseCommand
+from common_django.logging_app.benchmarks import run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the request logging middleware and log ingestion, printing the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per middleware benchmark.')
+        parser.add_argument('--lines', type=int, default=20000, help='Log lines per parse and memory benchmark.')
+        parser.add_argument('--rows', type=int, default=5000, help='Rows per ingest benchmark.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Log entries per bulk insert.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per timing, the best one (the median for the middleware) is kept.')
+        parser.add_argument('--output', help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            requests=options['requests'],
+            lines=options['lines'],
+            rows=options['rows'],
+            batch_size=options['batch_size'],
+            repeat=options['repeat'],
+        )
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,77 @@
+import time
+import signal
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from common_django.logging_app.log_processor import LogProcessor, LOG_INGEST_WORKERS, LOG_INGEST_POOL, LOG_BATCH_SIZE
+from common_django.logging_app.locks import get_scheduler_lock
+from common_django.logging_app.watcher import get_watcher, POLL_INTERVAL
+from common_django.logging_app.metrics import start_metrics_server
+
+logger = logging.getLogger('log_processor')
+
+
+class Command(BaseCommand):
+    help = (
+        'Ingest the request log files into the database as a dedicated process. By default the '
+        'command follows the log files and ingests new lines as soon as they are written.'
+    )
+
+    def add_arguments(self, parser):
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--once', action='store_true', help='Ingest the lines written so far, then exit.')
+        mode.add_argument('--follow', action='store_true', help='Keep ingesting new lines as they are written (default).')
+        parser.add_argument('--workers', type=int, default=LOG_INGEST_WORKERS, help='Number of log files ingested concurrently.')
+        parser.add_argument('--pool', choices=['thread', 'process'], default=LOG_INGEST_POOL, help='How log files are ingested concurrently.')
+        parser.add_argument('--batch-size', type=int, default=LOG_BATCH_SIZE, help='Log entries per bulk insert.')
+        parser.add_argument(
+            '--interval', type=float, default=60,
+            help='Max seconds between two runs when following, even if no change was noticed.',
+        )
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help='Seconds between checks where inotify is unavailable.')
+        parser.add_argument('--metrics-port', type=int, help='Serve the metrics in the Prometheus text format on this port.')
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+
+        processor = LogProcessor(batch_size=options['batch_size'], workers=options['workers'], pool=options['pool'])
+
+        # One ingester per host (or cluster), shared with the schedulers of the web processes
+        lock = get_scheduler_lock()
+        if options['once']:
+            if not lock.acquire():
+                raise CommandError('Another process holds the scheduler lock and is ingesting the logs.')
+            try:
+                processor.run()
+            finally:
+                lock.release()
+            return
+
+        # Stop cleanly on SIGTERM, like on Ctrl+C
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+
+        watcher = None
+        try:
+            while not lock.acquire():
+                logger.info("Another process holds the scheduler lock, standing by.")
+                time.sleep(options['interval'])
+
+            # Watch before the first run, so lines written during the run wake the next one
+            watcher = get_watcher(processor, options['poll_interval'])
+            self.stdout.write(f"Following {processor.log_file_path} with {type(watcher).__name__}.")
+            while True:
+                processor.run()
+                close_old_connections()
+                watcher.wait(options['interval'])
+                if not lock.acquire():
+                    raise CommandError('Lost the scheduler lock.')
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped following the log files.')
+        finally:
+            if watcher is not None:
+                watcher.close()
+            lock.release()
+
+    def handle_sigterm(self, signum, frame):
+        raise KeyboardInterrupt
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from common_django.logging_app import retention
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert the request log table into a table partitioned by timestamp (LOG_PARTITIONING, PostgreSQL only), '
+        'copying the existing rows. Stop the log ingestion first, the table is locked while the rows are copied.'
+    )
+
+    def handle(self, *args, **options):
+        try:
+            partitioned = retention.partition_table()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if partitioned:
+            self.stdout.write(self.style.SUCCESS('Partitioned the request log table.'))
+        else:
+            self.stdout.write('The request log table is already partitioned.')
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from common_django.logging_app import retention
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete request logs older than the retention period (LOG_RETENTION_DAYS) and rollups older than the '
+        'rollup retention period (LOG_ROLLUP_RETENTION_DAYS). On a partitioned table, also create the upcoming partitions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Retention period in days, defaults to LOG_RETENTION_DAYS.')
+        parser.add_argument(
+            '--rollup-days', type=int, help='Retention period of the rollups in days, defaults to LOG_ROLLUP_RETENTION_DAYS.',
+        )
+        parser.add_argument('--chunk-size', type=int, help='Rows deleted per transaction, defaults to LOG_RETENTION_CHUNK_SIZE.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the request logs that would be deleted.')
+
+    def handle(self, *args, **options):
+        retention_days = options['days'] if options['days'] is not None else retention.LOG_RETENTION_DAYS
+        rollup_retention_days = (
+            options['rollup_days'] if options['rollup_days'] is not None else retention.LOG_ROLLUP_RETENTION_DAYS
+        )
+        if retention_days is None and rollup_retention_days is None and not retention.LOG_PARTITIONING:
+            raise CommandError('No retention period, set LOG_RETENTION_DAYS or LOG_ROLLUP_RETENTION_DAYS or pass --days.')
+
+        deleted = retention.prune_request_logs(retention_days, options['chunk_size'], options['dry_run'])
+        if retention_days is None:
+            self.stdout.write('No retention period for the request logs, they are kept.')
+        elif options['dry_run']:
+            self.stdout.write(f'{deleted} request logs older than {retention_days} days would be deleted.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} request logs older than {retention_days} days.'))
+
+        if rollup_retention_days is None:
+            return
+        deleted = retention.prune_rollups(rollup_retention_days, options['chunk_size'], options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f'{deleted} rollups older than {rollup_retention_days} days would be deleted.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} rollups older than {rollup_retention_days} days.'))
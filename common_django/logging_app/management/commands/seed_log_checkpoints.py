@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from common_django.logging_app.log_processor import LogProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        'Mark the log files without checkpoint as read up to their end, without storing their entries. '
+        'Run it once when upgrading from a version without checkpoints, before the log processor first runs, '
+        'so the lines already stored are not ingested again.'
+    )
+
+    def handle(self, *args, **options):
+        seeded = LogProcessor().seed_checkpoints()
+        for log_file_path in seeded:
+            self.stdout.write(f'Marked {log_file_path} as read.')
+        self.stdout.write(self.style.SUCCESS(f'Seeded the checkpoints of {len(seeded)} log files.'))
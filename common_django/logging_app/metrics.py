@@ -0,0 +1,184 @@
+"""
+Self-instrumentation of the log processor and the scheduler.
+
+The code reports metrics through get_metrics(), which returns the hook configured by
+LOG_METRICS_HOOK (dotted path to a class):
+
+    common_django.logging_app.metrics.NoOpMetrics      default, discards everything
+    common_django.logging_app.metrics.InMemoryMetrics  keeps counters, gauges and histograms
+                                                       in memory, rendered in the Prometheus
+                                                       text format by views.metrics (or by
+                                                       ingest_request_logs --metrics-port)
+
+A custom hook (e.g. forwarding to statsd) implements inc(), set(), observe() and render().
+Metrics are kept per process: with LOG_INGEST_POOL = 'process', the worker processes' metrics
+aren't reported.
+"""
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Dotted path of the metrics hook class
+LOG_METRICS_HOOK = getattr(settings, 'LOG_METRICS_HOOK', 'common_django.logging_app.metrics.NoOpMetrics')
+
+# Upper bounds (in seconds) of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+# Type and description of the reported metrics
+METRICS = {
+    'request_log_lines_read_total': ('counter', 'Log lines read from the log files.'),
+    'request_log_lines_parsed_total': ('counter', 'Log lines parsed into log entries.'),
+    'request_log_lines_failed_total': ('counter', 'Log lines or entries that could not be parsed or stored.'),
+    'request_log_duplicates_total': ('counter', 'Log entries skipped because they were already stored.'),
+    'request_log_rows_written_total': ('counter', 'Request log rows written to the database.'),
+    'request_log_batch_seconds': ('histogram', 'Time spent writing a batch of log entries to the database.'),
+    'request_log_bytes_behind': ('gauge', 'Bytes of the log file not ingested yet.'),
+    'request_log_lag_seconds': ('gauge', 'Seconds between the newest ingested log entry and its ingestion.'),
+    'request_log_job_seconds': ('histogram', 'Duration of the scheduled jobs.'),
+    'request_log_job_failures_total': ('counter', 'Scheduled jobs that raised an error.'),
+}
+
+
+class NoOpMetrics:
+    """
+    Discards all metrics.
+    """
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def set(self, name, value, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def render(self):
+        return ''
+
+
+class InMemoryMetrics:
+    """
+    Thread-safe counters, gauges and histograms kept in memory, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._values = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Count per bucket (not cumulative), sum and count
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0, 0]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: (list(counts), total, count) for key, (counts, total, count) in self._histograms.items()}
+
+        lines = []
+        for name in sorted({name for name, _ in values} | {name for name, _ in histograms}):
+            metric_type, description = METRICS.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+            for (metric_name, labels), value in sorted(values.items()):
+                if metric_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+            for (metric_name, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+                cumulative = 0
+                for upper_bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (('le', '+Inf' if upper_bound == math.inf else format_value(upper_bound)),)
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the metrics hook configured by LOG_METRICS_HOOK, shared by the whole process.
+    """
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = import_string(LOG_METRICS_HOOK)()
+    return _metrics
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics in the Prometheus text format on any path.
+    """
+
+    def do_GET(self):
+        body = get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes aren't worth a log line
+        pass
+
+
+def start_metrics_server(port, address=''):
+    """
+    Serves the metrics over HTTP from a daemon thread, for processes without a web server
+    (the ingest_request_logs command). Returns the server.
+    """
+    server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='log_metrics_server', daemon=True).start()
+    return server
@@ -1,54 +1,217 @@
+import time
 import logging
 import inspect
+import threading
+from collections import OrderedDict
 from django.utils.timezone import now
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import AnonymousUser
+from django.dispatch import receiver
+from django.urls import Resolver404, resolve
+from django.utils.autoreload import file_changed
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject, empty
+from common_django.logging_app import formats
+from common_django.logging_app.handlers import queue_logger_handlers
+from common_django.logging_app.params import RequestParamsCapture
+from common_django.logging_app.profiling import RequestInstrumentation
+from common_django.logging_app.rules import LoggingRules
+
+# View metadata logged when the request couldn't be resolved to a view
+UNKNOWN_VIEW_METADATA = {
+    "app_name": 'Unknown',
+    "view": 'Unknown',
+    "class_name": 'Unknown',
+    "function_name": 'Unknown',
+    "line_number": 'Unknown',
+}
+
+
+class ViewMetadataCache:
+    """
+    A bounded, thread-safe LRU cache of the view metadata logged for each view.
+    The metadata only depends on the resolved view, so it is computed once per view
+    instead of introspecting the view source on every request.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            metadata = self._entries.get(key)
+            if metadata is not None:
+                self._entries.move_to_end(key)
+            return metadata
+
+    def set(self, key, metadata):
+        with self._lock:
+            self._entries[key] = metadata
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+view_metadata_cache = ViewMetadataCache(getattr(settings, 'LOG_VIEW_CACHE_SIZE', 1024))
+
+
+@receiver(file_changed)
+def clear_view_metadata_cache(sender, file_path, **kwargs):
+    """
+    Drop the cached view metadata when the autoreloader sees a source file change,
+    as line numbers and view names may have changed.
+    """
+    view_metadata_cache.clear()
+
 
 class SimpleLoggingMiddleware(MiddlewareMixin):
     """
     A middleware to log incoming HTTP requests and outgoing HTTP responses with additional details
     such as app name, view, class, function, line number, and request/response data.
+    It runs natively in both sync (WSGI) and async (ASGI) middleware stacks.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
-        self.get_response = get_response
+        # Sets get_response and switches to async mode when the next middleware is async
+        super().__init__(get_response)
+        # Format of the log records, 'legacy' (dict repr) or 'json' (JSON lines)
+        self.log_format = getattr(settings, 'LOG_FORMAT', formats.LEGACY_FORMAT)
+        # Log a single record per request, with status code and duration, instead of two
+        self.combined_record = getattr(settings, 'LOG_COMBINED_RECORD', False)
+        # Exclusion and sampling rules, compiled once at startup
+        self.rules = LoggingRules.from_settings()
+        # Which request parameters are logged, never forcing the body to be parsed
+        self.params_capture = RequestParamsCapture.from_settings()
+        # Opt-in SQL statistics and profiling of the requests
+        self.instrumentation = RequestInstrumentation.from_settings()
+
+        if self.async_mode:
+            self.queue_async_logging()
+
+    def queue_async_logging(self):
+        """
+        Under ASGI the records are logged on the event loop, so the request_logger handlers
+        writing synchronously (e.g. a FileHandler) are moved to a background thread, unless
+        LOG_ASYNC_QUEUE is disabled.
+        """
+        if not getattr(settings, 'LOG_ASYNC_QUEUE', True):
+            logging.warning(
+                "LOG_ASYNC_QUEUE is disabled, the request logs are written on the event loop, "
+                "which is blocked while they are written."
+            )
+            return
+
+        for handler in queue_logger_handlers('request_logger'):
+            logging.info(f"Writing the request logs of {handler} from a background thread.")
 
     def __call__(self, request):
+        # Exit out to async mode, if needed
+        if self.async_mode:
+            return self.__acall__(request)
+
+        # Excluded requests (health checks, static files, ...) are never logged
+        if self.rules.is_excluded(request):
+            return self.get_response(request)
+
+        if self.combined_record:
+            return self.process_with_combined_record(request)
+
+        if self.rules.samples:
+            return self.process_with_sampled_records(request)
+
         # Log request details before processing the request
         self.log_request_details(request)
 
         # Call the next middleware or view
-        response = self.get_response(request)
+        response = self.get_instrumented_response(request)
 
         # Log response details after processing the request
         self.log_response_details(request, response)
 
         return response
 
-    def log_request_details(self, request):
+    async def __acall__(self, request):
+        """
+        Async version of __call__, used under ASGI so async views don't pay a thread hop.
+        The user is resolved without blocking the event loop, and the records are written by
+        a background thread (see queue_async_logging()).
+        """
+        # Excluded requests (health checks, static files, ...) are never logged
+        if self.rules.is_excluded(request):
+            return await self.get_response(request)
+
+        request._log_user_fields = await self.aget_log_user_fields(request)
+
+        if self.combined_record:
+            timestamp = self.get_formatted_timestamp()
+            start_time = time.perf_counter()
+
+            # Call the next middleware or view
+            response = await self.get_response(request)
+
+            # CPU time of the event loop thread isn't attributable to a single request
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            if self.rules.should_log(request, response, duration_ms):
+                self.log_request_response_details(request, response, timestamp, duration_ms, None)
+            return response
 
+        if self.rules.samples:
+            request_log_message = self.build_request_log_message(request)
+            start_time = time.perf_counter()
+
+            # Call the next middleware or view
+            response = await self.get_response(request)
+
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            if self.rules.should_log(request, response, duration_ms):
+                self.write_log_message("Request", request_log_message)
+                self.log_response_details(request, response)
+            return response
+
+        # Log request details before processing the request
+        self.log_request_details(request)
+
+        # Call the next middleware or view
+        response = await self.get_response(request)
+
+        # Log response details after processing the request
+        self.log_response_details(request, response)
+
+        return response
+
+    def log_request_details(self, request):
         """
         Logs details of the incoming request, including app name, view, class, function, and more.
         """
-        # Prepare log details
-        log_message = {
+        self.write_log_message("Request", self.build_request_log_message(request))
+
+    def build_request_log_message(self, request):
+        """
+        Returns the details of the incoming request logged in the request record.
+        """
+        return {
             "timestamp": self.get_formatted_timestamp(),
             "method": request.method,
-            "url": request.build_absolute_uri(),
+            "url": self.get_log_url(request),
             # "headers": dict(request.headers),
             "remote_ip": request.META.get('REMOTE_ADDR', 'Unknown'),
-            "request_params": request.GET.dict() if request.method == 'GET' else request.POST.dict(),
-            "app_name": self.get_app_name(request),
-            "view": self.get_view_name(request),
-            "class_name": self.get_class_name(request),
-            "function_name": self.get_function_name(request),
-            "line_number": self.get_line_number(request),
-            "user": request.user if request.user.is_authenticated else "Anonymous",
+            "request_params": self.params_capture.capture(request),
+            **self.get_view_metadata(request),
+            **self.get_log_user_fields(request),
         }
 
-        # Get logger
-        logger = logging.getLogger('request_logger')
-        logger.info(f"Request: {log_message}")
-
     def log_response_details(self, request, response):
         """
         Logs details of the outgoing response, including app name, view, class, function, and more.
@@ -56,30 +219,289 @@ class SimpleLoggingMiddleware(MiddlewareMixin):
         # Prepare log details
         log_message = {
             "timestamp": self.get_formatted_timestamp(),
-            # "status_code": response.status_code,
-            "url": request.build_absolute_uri(),
+            "status_code": response.status_code,
+            "url": self.get_log_url(request),
             "method": request.method,
             # "headers": dict(request.headers),
-            "user": request.user if request.user.is_authenticated else "Anonymous",
+            **self.get_log_user_fields(request),
             "remote_ip": request.META.get('REMOTE_ADDR', 'Unknown'),
             # "response_content": response.content.decode('utf-8')[:200],  # Log a snippet of the response content
-            "app_name": self.get_app_name(request),
-            "view": self.get_view_name(request),
-            "class_name": self.get_class_name(request),
-            "function_name": self.get_function_name(request),
-            "line_number": self.get_line_number(request),
+            **self.get_view_metadata(request),
+            **getattr(request, '_log_measurement', {}),
         }
 
+        self.write_log_message("Response", log_message)
+
+    def process_with_combined_record(self, request):
+        """
+        Calls the next middleware or view and logs one record for the request and its response,
+        including the status code, response size and the wall clock and CPU time spent.
+        """
+        timestamp = self.get_formatted_timestamp()
+        start_time = time.perf_counter()
+        start_cpu_time = time.thread_time()
+
+        # Call the next middleware or view
+        response = self.get_instrumented_response(request)
+
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        cpu_ms = (time.thread_time() - start_cpu_time) * 1000
+
+        if self.rules.should_log(request, response, duration_ms):
+            self.log_request_response_details(request, response, timestamp, duration_ms, cpu_ms)
+
+        return response
+
+    def process_with_sampled_records(self, request):
+        """
+        Calls the next middleware or view and logs the request and response records only if the
+        sampling rules keep the request. The request record is prepared before the view runs but
+        written once the response is known.
+        """
+        request_log_message = self.build_request_log_message(request)
+        start_time = time.perf_counter()
+
+        # Call the next middleware or view
+        response = self.get_instrumented_response(request)
+
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        if self.rules.should_log(request, response, duration_ms):
+            self.write_log_message("Request", request_log_message)
+            self.log_response_details(request, response)
+
+        return response
+
+    def get_instrumented_response(self, request):
+        """
+        Calls the next middleware or view, counting its SQL queries and profiling it when enabled.
+        The measurement is logged with the response.
+        """
+        if not self.instrumentation.enabled:
+            return self.get_response(request)
+
+        with self.instrumentation.measure() as measurement:
+            response = self.get_response(request)
+        request._log_measurement = measurement.get_log_fields()
+        return response
+
+    def log_request_response_details(self, request, response, timestamp, duration_ms, cpu_ms):
+        """
+        Logs details of the request together with its response and timings.
+        """
+        # Prepare log details
+        log_message = {
+            "timestamp": timestamp,
+            "method": request.method,
+            "url": self.get_log_url(request),
+            "remote_ip": request.META.get('REMOTE_ADDR', 'Unknown'),
+            "request_params": self.params_capture.capture(request),
+            **self.get_view_metadata(request),
+            **self.get_log_user_fields(request),
+            "status_code": response.status_code,
+            "response_size": self.get_response_size(response),
+            "duration_ms": round(duration_ms, 3),
+            "cpu_ms": round(cpu_ms, 3) if cpu_ms is not None else None,
+            **getattr(request, '_log_measurement', {}),
+        }
+
+        self.write_log_message("Access", log_message)
+
+    def write_log_message(self, record_type, log_message):
+        """
+        Writes the log message to the request_logger, prefixed with the record type
+        ("Request", "Response" or "Access").
+        """
         # Get logger
         logger = logging.getLogger('request_logger')
-        logger.info(f"Response: {log_message}")
+        # The structured record is handed to the handlers too, for the RequestLogDatabaseHandler
+        log_data = self.build_log_data(log_message)
+        logger.info(
+            "%s: %s", record_type, self.format_log_message(log_message, log_data),
+            extra={'log_data': log_data, 'log_record_type': record_type},
+        )
+
+    def get_log_url(self, request):
+        """
+        Returns the absolute URL logged for the request, its query string following the
+        request parameters capture. It is built once and shared by the request's records.
+        """
+        url = getattr(request, '_log_url', None)
+        if url is None:
+            url = request._log_url = request.build_absolute_uri(self.params_capture.get_full_path(request))
+        return url
+
+    def get_log_user_fields(self, request):
+        """
+        Returns the user and user id logged for the request, loading the user only if needed:
+        - the user and its id if the view (or another middleware) already loaded it,
+        - otherwise the user logged in the session, if any (see get_session_user()),
+        - or "Anonymous" and no id.
+        Anonymous requests only read the session, without a user query.
+        """
+        user = self.get_loaded_user(request)
+        if user is not None:
+            return self.build_log_user_fields(user)
+
+        user_fields = getattr(request, '_log_user_fields', None)
+        if user_fields is None:
+            user_fields = request._log_user_fields = self.build_log_user_fields(self.get_session_user(request))
+        return user_fields
+
+    async def aget_log_user_fields(self, request):
+        """
+        Async version of get_log_user_fields, reads the session without blocking the event loop.
+        """
+        user = self.get_loaded_user(request)
+        if user is None:
+            user = await self.aget_session_user(request)
+        return self.build_log_user_fields(user)
+
+    def get_session_user(self, request):
+        """
+        Returns the user logged in the session of the request, or an anonymous user. The session
+        user id alone can't be trusted (the password may have changed since the login), so the
+        user is loaded and its session hash verified by auth.get_user(), like the authentication
+        middleware does. It is cached on the request so request.user doesn't load it again.
+        """
+        session = getattr(request, 'session', None)
+        if session is None or session.get(SESSION_KEY) is None:
+            return AnonymousUser()
+        user = request._cached_user = auth.get_user(request)
+        return user
+
+    async def aget_session_user(self, request):
+        """
+        Async version of get_session_user, cached for request.auser().
+        """
+        session = getattr(request, 'session', None)
+        if session is None:
+            return AnonymousUser()
+        if hasattr(session, 'aget'):
+            session_user_id = await session.aget(SESSION_KEY)
+        else:
+            session_user_id = await sync_to_async(session.get)(SESSION_KEY)
+        if session_user_id is None:
+            return AnonymousUser()
+
+        if hasattr(auth, 'aget_user'):
+            user = await auth.aget_user(request)
+        else:
+            user = await sync_to_async(auth.get_user)(request)
+        request._acached_user = user
+        return user
+
+    def get_loaded_user(self, request):
+        """
+        Returns the user of the request if it is already loaded, or None: a user set on the
+        request by something else than the authentication middleware (DRF, token or remote
+        user authentication, auth.login()), or the middleware's lazy user once evaluated.
+        """
+        user = request.__dict__.get('user')
+        if user is not None:
+            if not isinstance(user, SimpleLazyObject):
+                return user
+            if user._wrapped is not empty:
+                return user._wrapped
+
+        # Loaded through request.auser() or by the lazy user's own cache
+        user = getattr(request, '_cached_user', None)
+        if user is None:
+            user = getattr(request, '_acached_user', None)
+        return user
+
+    def build_log_user_fields(self, user):
+        if user.is_authenticated:
+            return {"user": user, "user_id": user.pk}
+        return {"user": "Anonymous", "user_id": None}
+
+    def get_response_size(self, response):
+        """
+        Returns the size of the response body in bytes, or None if it isn't known up front (streaming).
+        """
+        if response.streaming:
+            content_length = response.get('Content-Length')
+            return int(content_length) if content_length and content_length.isdigit() else None
+        return len(response.content)
+
+    def format_log_message(self, log_message, log_data=None):
+        """
+        Renders the log message in the configured log format.
+        In JSON format the user is rendered as its email and id instead of its repr.
+        """
+        if self.log_format != formats.JSON_FORMAT:
+            return log_message
+
+        return formats.dumps(log_data if log_data is not None else self.build_log_data(log_message))
+
+    def build_log_data(self, log_message):
+        """
+        Returns a copy of the log message with the user rendered as its email,
+        as stored by the log processor.
+        """
+        log_data = dict(log_message)
+        user = log_data.get('user')
+        if user == 'Anonymous':
+            log_data['user'] = None
+        elif user is not None:
+            log_data['user'] = user.email
+        return log_data
+
+    def get_view_metadata(self, request):
+        """
+        Returns the app name, view, class name, function name and line number of the view
+        handling the request. The values are cached per view and shared by the request and
+        response log records.
+        """
+        metadata = getattr(request, '_log_view_metadata', None)
+        if metadata is not None:
+            return metadata
+
+        resolver_match = self.get_resolver_match(request)
+        if not resolver_match:
+            # No view matches the URL
+            return UNKNOWN_VIEW_METADATA
+
+        # Class-based views share a view function per URL pattern, and the function
+        # name and line number also depend on the view name
+        cache_key = (resolver_match.func, resolver_match.view_name)
+        metadata = view_metadata_cache.get(cache_key)
+        if metadata is None:
+            metadata = {
+                "app_name": self.get_app_name(request),
+                "view": self.get_view_name(request),
+                "class_name": self.get_class_name(request),
+                "function_name": self.get_function_name(request),
+                "line_number": self.get_line_number(request),
+            }
+            view_metadata_cache.set(cache_key, metadata)
+
+        request._log_view_metadata = metadata
+        return metadata
+
+    def get_resolver_match(self, request):
+        """
+        Returns the URL resolver match of the request, or None if no view matches its URL.
+        Request records are logged before Django resolves the URL, so it is resolved here in
+        that case, once per request.
+        """
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match:
+            return resolver_match
+
+        if not hasattr(request, '_log_resolver_match'):
+            try:
+                request._log_resolver_match = resolve(request.path_info, getattr(request, 'urlconf', None))
+            except Resolver404:
+                request._log_resolver_match = None
+        return request._log_resolver_match
 
     def get_view_name(self, request):
         """
         Returns the view name for the current request.
         """
-        if hasattr(request, 'resolver_match') and request.resolver_match:
-            return request.resolver_match.view_name
+        resolver_match = self.get_resolver_match(request)
+        if resolver_match:
+            return resolver_match.view_name
         return 'Unknown'
 
     def get_app_name(self, request):
@@ -87,8 +509,9 @@ class SimpleLoggingMiddleware(MiddlewareMixin):
         Returns the Django app name where the view is defined based on the view function/module.
         """
         # Check if the request has a valid resolver match
-        if hasattr(request, 'resolver_match') and request.resolver_match:
-            view_func = request.resolver_match.func  # Get the view function or class
+        resolver_match = self.get_resolver_match(request)
+        if resolver_match:
+            view_func = resolver_match.func  # Get the view function or class
 
             # If the view is a class-based view, we need to get the actual view class
             if hasattr(view_func, 'view_class'):
@@ -110,8 +533,9 @@ class SimpleLoggingMiddleware(MiddlewareMixin):
         Extracts the class name (if available) where the log message was generated.
         """
         # If the view is a class-based view, we can look up the view class
-        if hasattr(request, 'resolver_match') and request.resolver_match:
-            view = request.resolver_match.func
+        resolver_match = self.get_resolver_match(request)
+        if resolver_match:
+            view = resolver_match.func
             if hasattr(view, 'view_class'):
                 return view.view_class.__name__
             return 'Unknown'
@@ -121,14 +545,15 @@ class SimpleLoggingMiddleware(MiddlewareMixin):
         """
         Extracts the function name of the view that is handling the request.
         """
-        if hasattr(request, 'resolver_match') and request.resolver_match:
-            view_func = request.resolver_match.func  # Get the view function or class
+        resolver_match = self.get_resolver_match(request)
+        if resolver_match:
+            view_func = resolver_match.func  # Get the view function or class
 
             # If the view is class-based, get the method (like 'get', 'post', etc.)
             if hasattr(view_func, 'view_class'):
                 view_func = view_func.view_class
                 # In class-based views, we can capture the method (e.g., 'get', 'post')
-                method_name = request.resolver_match.view_name.split('.')[-1]
+                method_name = resolver_match.view_name.split('.')[-1]
                 return f"{view_func.__name__}.{method_name}"
             else:
                 # If it's function-based, return the function name
@@ -139,12 +564,13 @@ class SimpleLoggingMiddleware(MiddlewareMixin):
         """
         Extracts the line number from where the view was executed.
         """
-        if hasattr(request, 'resolver_match') and request.resolver_match:
-            view_func = request.resolver_match.func  # Get the view function or class
+        resolver_match = self.get_resolver_match(request)
+        if resolver_match:
+            view_func = resolver_match.func  # Get the view function or class
 
             if isinstance(view_func, type):  # If it's a class-based view (CBV)
                 # The view function could be a class; we need to find the method
-                view_method_name = request.resolver_match.view_name.split('.')[-1]
+                view_method_name = resolver_match.view_name.split('.')[-1]
                 try:
                     # Get the method of the class based on the method name (like 'get', 'post', etc.)
                     method = getattr(view_func, view_method_name, None)
@@ -176,5 +602,5 @@ class SimpleLoggingMiddleware(MiddlewareMixin):
         """
         Returns the formatted timestamp string of the current time, including timezone if necessary.
         """
-        # Get the current time and format it
-        return now().strftime('%Y-%m-%d %H:%M:%S %Z')  # Example: 2024-10-04 07:19:00 UTC
+        # Microsecond precision, so distinct requests in the same second keep distinct timestamps
+        return formats.format_timestamp(now())  # Example: 2024-10-04T07:19:00.123456+00:00
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging_app', '0004_requestlog_cpu_ms_requestlog_duration_ms_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_name', models.CharField(max_length=255)),
+                ('view', models.CharField(max_length=255)),
+                ('class_name', models.CharField(max_length=255)),
+                ('function_name', models.CharField(max_length=255)),
+                ('line_number', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'View Metadata',
+                'verbose_name_plural': 'View Metadata',
+                'unique_together': {('app_name', 'view', 'class_name', 'function_name', 'line_number')},
+            },
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='host',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='path',
+            field=models.CharField(default='', max_length=2048),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='view_metadata',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='logging_app.viewmetadata'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+from urllib.parse import urlsplit
+
+from django.db import migrations
+
+# Rows migrated per query
+CHUNK_SIZE = 2000
+
+
+def split_urls_and_views(apps, schema_editor):
+    """
+    Fill host, path and view_metadata of the existing rows from url and the view columns,
+    in chunks of rows read by primary key so each chunk is a single indexed range scan.
+    """
+    RequestLog = apps.get_model('logging_app', 'RequestLog')
+    ViewMetadata = apps.get_model('logging_app', 'ViewMetadata')
+
+    # ViewMetadata ids by view columns, there are few views so they're all kept in memory
+    view_fields = ('app_name', 'view', 'class_name', 'function_name', 'line_number')
+    view_metadata_ids = {}
+
+    last_pk = 0
+    while True:
+        rows = list(RequestLog.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'url', *view_fields)[:CHUNK_SIZE])
+        if not rows:
+            break
+        for row in rows:
+            split_url = urlsplit(row.url)
+            row.host = split_url.netloc[:255]
+            row.path = split_url.path[:2048]
+
+            key = tuple(getattr(row, field) for field in view_fields)
+            view_metadata_id = view_metadata_ids.get(key)
+            if view_metadata_id is None:
+                app_name, view, class_name, function_name, line_number = key
+                view_metadata_id = view_metadata_ids[key] = ViewMetadata.objects.get_or_create(
+                    app_name=app_name,
+                    view=view,
+                    class_name=class_name,
+                    function_name=function_name,
+                    line_number=int(line_number) if str(line_number).isdigit() else None,
+                )[0].pk
+            row.view_metadata_id = view_metadata_id
+        RequestLog.objects.bulk_update(rows, ['host', 'path', 'view_metadata'])
+        last_pk = rows[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    # Every chunk is committed on its own, a single transaction over the whole table would
+    # hold its locks and undo log until the end. Rows are rewritten identically if rerun.
+    atomic = False
+
+    dependencies = [
+        ('logging_app', '0005_viewmetadata_requestlog_host_path_view_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_urls_and_views, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_timestamp_index(apps, schema_editor):
+    """
+    Index the timestamp with a compact BRIN index on PostgreSQL, rows are inserted in
+    roughly chronological order. Other databases get a regular B-tree index.
+    """
+    using = 'USING brin ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(f'CREATE INDEX requestlog_timestamp_idx ON logging_app_requestlog {using}(timestamp)')
+
+
+def drop_timestamp_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('DROP INDEX requestlog_timestamp_idx ON logging_app_requestlog')
+    else:
+        schema_editor.execute('DROP INDEX requestlog_timestamp_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging_app', '0006_split_requestlog_urls_and_views'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='requestlog',
+            unique_together={('timestamp', 'host', 'path', 'user')},
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='url',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='app_name',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='view',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='class_name',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='function_name',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='line_number',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['view_metadata', 'timestamp'], name='requestlog_view_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['user', 'timestamp'], name='requestlog_user_time_idx'),
+        ),
+        # Declared in the state so that table rebuilds (SQLite) recreate it, created with
+        # raw SQL as the BRIN method only exists on PostgreSQL
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_timestamp_index, drop_timestamp_index),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='requestlog',
+                    index=models.Index(fields=['timestamp'], name='requestlog_timestamp_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging_app', '0007_compact_requestlog_schema'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('method', models.CharField(max_length=10)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('duration_count', models.PositiveIntegerField(default=0)),
+                ('duration_sum_ms', models.FloatField(default=0)),
+                ('duration_max_ms', models.FloatField(default=0)),
+                ('bucket_10ms', models.PositiveIntegerField(default=0)),
+                ('bucket_25ms', models.PositiveIntegerField(default=0)),
+                ('bucket_50ms', models.PositiveIntegerField(default=0)),
+                ('bucket_100ms', models.PositiveIntegerField(default=0)),
+                ('bucket_250ms', models.PositiveIntegerField(default=0)),
+                ('bucket_500ms', models.PositiveIntegerField(default=0)),
+                ('bucket_1000ms', models.PositiveIntegerField(default=0)),
+                ('bucket_2500ms', models.PositiveIntegerField(default=0)),
+                ('bucket_5000ms', models.PositiveIntegerField(default=0)),
+                ('bucket_inf', models.PositiveIntegerField(default=0)),
+                ('view_metadata', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='logging_app.viewmetadata')),
+            ],
+            options={
+                'verbose_name': 'Request Rollup',
+                'verbose_name_plural': 'Request Rollups',
+                'indexes': [models.Index(fields=['view_metadata', 'minute'], name='requestrollup_view_time_idx')],
+                'unique_together': {('minute', 'view_metadata', 'method', 'status_code')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UserTrafficRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('duration_sum_ms', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Traffic Rollup',
+                'verbose_name_plural': 'User Traffic Rollups',
+                'unique_together': {('hour', 'user')},
+            },
+        ),
+    ]
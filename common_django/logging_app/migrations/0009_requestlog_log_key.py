@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging_app', '0008_requestrollup_usertrafficrollup'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='log_hash',
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='log_key',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:59
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging_app', '0009_requestlog_log_key'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='requestlog',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
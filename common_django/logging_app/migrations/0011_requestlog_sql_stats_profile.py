@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging_app', '0010_requestlog_timestamp_precision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='profile',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='sql_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='sql_time_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:40
+
+from django.db import migrations
+
+from common_django.logging_app import models
+
+# Rows migrated per query
+CHUNK_SIZE = 2000
+
+# Fields hashed into the log_key (see RequestLog.compute_log_key)
+KEY_FIELDS = (
+    'timestamp', 'method', 'host', 'path', 'request_params', 'remote_ip', 'view_metadata_id', 'user_id', 'status_code',
+    'response_size', 'duration_ms', 'cpu_ms',
+)
+
+
+def backfill_log_keys(apps, schema_editor):
+    """
+    Fill the log_key of the rows stored before migration 0009, so re-ingesting their log lines
+    finds them instead of storing them again. Chunks are read by primary key so each one is a
+    single indexed range scan.
+
+    The key is computed by the current RequestLog.compute_log_key (historical models have no
+    methods) so it matches the key of the same line at ingestion. Rows duplicating a stored
+    key, which the dropped log_hash didn't catch, are left without one.
+    """
+    RequestLog = apps.get_model('logging_app', 'RequestLog')
+
+    last_pk = 0
+    while True:
+        rows = list(
+            RequestLog.objects.filter(pk__gt=last_pk, log_key__isnull=True).order_by('pk').only('pk', *KEY_FIELDS)[:CHUNK_SIZE]
+        )
+        if not rows:
+            break
+
+        keys = {row.pk: models.RequestLog.compute_log_key(row) for row in rows}
+        stored_keys = set(RequestLog.objects.filter(log_key__in=keys.values()).values_list('log_key', flat=True))
+        updated_rows = []
+        for row in rows:
+            if keys[row.pk] not in stored_keys:
+                row.log_key = keys[row.pk]
+                stored_keys.add(row.log_key)
+                updated_rows.append(row)
+        RequestLog.objects.bulk_update(updated_rows, ['log_key'])
+        last_pk = rows[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    # Every chunk is committed on its own like in 0006, rows already keyed are skipped if rerun
+    atomic = False
+
+    dependencies = [
+        ('logging_app', '0011_requestlog_sql_stats_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_log_keys, migrations.RunPython.noop),
+    ]
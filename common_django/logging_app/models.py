@@ -1,34 +1,151 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from datetime import timezone as dt_timezone
 import hashlib
+import json
 
-class RequestLog(models.Model):
-    timestamp = models.DateTimeField(auto_now_add=True)
-    method = models.CharField(max_length=10)
-    url = models.URLField()
-    remote_ip = models.GenericIPAddressField()
-    request_params = models.JSONField(null=True, blank=True)
+class ViewMetadata(models.Model):
+    """
+    Lookup table of the views requests are logged for, so each RequestLog row only
+    stores a small foreign key instead of repeating the view details.
+    """
     app_name = models.CharField(max_length=255)
     view = models.CharField(max_length=255)
     class_name = models.CharField(max_length=255)
     function_name = models.CharField(max_length=255)
-    line_number = models.CharField(max_length=255)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    line_number = models.IntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.app_name} - {self.view}"
+
+    class Meta:
+        verbose_name = 'View Metadata'
+        verbose_name_plural = 'View Metadata'
+        unique_together = ('app_name', 'view', 'class_name', 'function_name', 'line_number')
+
+
+class RequestLog(models.Model):
+    # Time of the request as logged, defaults to now for entries created directly
+    timestamp = models.DateTimeField(default=timezone.now)
+    method = models.CharField(max_length=10)
+    # The URL is split so that the host isn't repeated in every path, the query string is in request_params
+    host = models.CharField(max_length=255)
+    path = models.CharField(max_length=2048)
+    remote_ip = models.GenericIPAddressField()
+    request_params = models.JSONField(null=True, blank=True)
+    # Both foreign keys lead a (foreign key, timestamp) index, so they need no index of their own
+    view_metadata = models.ForeignKey(ViewMetadata, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+
+    # Response details, only logged with the response or combined request/response records
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_size = models.PositiveBigIntegerField(null=True, blank=True)  # Bytes
+    duration_ms = models.FloatField(null=True, blank=True)  # Wall clock time spent in the view
+    cpu_ms = models.FloatField(null=True, blank=True)  # CPU time spent in the view
+
+    # Opt-in instrumentation of the request (see profiling.RequestInstrumentation)
+    sql_count = models.PositiveIntegerField(null=True, blank=True)  # SQL queries run by the view
+    sql_time_ms = models.FloatField(null=True, blank=True)  # Time spent in those queries
+    profile = models.TextField(null=True, blank=True)  # Profile summary, or path of the profile file
 
-    # A new field to store the hash of the log data
-    log_hash = models.CharField(max_length=64, unique=True, blank=True, null=True)  # SHA-256 hash
+    # 64-bit hash of the canonical fields of the entry (see compute_log_key), to skip duplicates
+    log_key = models.BigIntegerField(unique=True, blank=True, null=True)
+
+    @property
+    def url(self):
+        """
+        The logged URL, without scheme and query string.
+        """
+        return f"{self.host}{self.path}"
 
     def __str__(self):
         return f"{self.timestamp} - {self.method} - {self.url} - {self.user}"
 
+    def compute_log_key(self):
+        """
+        Returns the dedup key of the entry: a signed 64-bit BLAKE2b hash of its canonical fields,
+        so the same log line always gets the same key, whichever path stores it.
+        """
+        timestamp = self.timestamp.astimezone(dt_timezone.utc).isoformat() if self.timestamp else ''
+        request_params = json.dumps(self.request_params, sort_keys=True, separators=(',', ':'), default=str)
+        canonical = '\x1f'.join(str(value) for value in (
+            timestamp, self.method, self.host, self.path, request_params, self.remote_ip,
+            self.view_metadata_id, self.user_id, self.status_code, self.response_size, self.duration_ms, self.cpu_ms,
+        ))
+        return int.from_bytes(hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
     def save(self, *args, **kwargs):
-        # Generate the hash before saving the entry
-        if not self.log_hash:
-            log_data_str = f"{self.timestamp}-{self.url}-{self.user}-{self.method}"  # Create a unique string
-            self.log_hash = hashlib.sha256(log_data_str.encode('utf-8')).hexdigest()
+        # Generate the dedup key before saving the entry
+        if self.log_key is None:
+            self.log_key = self.compute_log_key()
         super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = 'Request Log'
         verbose_name_plural = 'Request Logs'
-        unique_together = ('timestamp', 'url', 'user')  # Unique constraint on the combination of these fields
+        # Dashboards filter on a time range by view or by user, retention on the timestamp
+        # alone (its index is a BRIN index on PostgreSQL, see migration 0007)
+        indexes = [
+            models.Index(fields=['timestamp'], name='requestlog_timestamp_idx'),
+            models.Index(fields=['view_metadata', 'timestamp'], name='requestlog_view_time_idx'),
+            models.Index(fields=['user', 'timestamp'], name='requestlog_user_time_idx'),
+        ]
+
+
+class RequestRollup(models.Model):
+    """
+    Requests per minute, view, method and status code, maintained by the LogProcessor as it
+    ingests request logs so dashboards don't have to scan RequestLog. Durations are counted
+    in fixed latency buckets (see rollups.LATENCY_BUCKETS_MS), each bucket counts the requests
+    up to its bound and above the previous one.
+    """
+    minute = models.DateTimeField()
+    view_metadata = models.ForeignKey(ViewMetadata, on_delete=models.PROTECT)
+    method = models.CharField(max_length=10)
+    status_code = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    # Only requests logged with their duration are counted in the latency columns
+    duration_count = models.PositiveIntegerField(default=0)
+    duration_sum_ms = models.FloatField(default=0)
+    duration_max_ms = models.FloatField(default=0)
+    bucket_10ms = models.PositiveIntegerField(default=0)
+    bucket_25ms = models.PositiveIntegerField(default=0)
+    bucket_50ms = models.PositiveIntegerField(default=0)
+    bucket_100ms = models.PositiveIntegerField(default=0)
+    bucket_250ms = models.PositiveIntegerField(default=0)
+    bucket_500ms = models.PositiveIntegerField(default=0)
+    bucket_1000ms = models.PositiveIntegerField(default=0)
+    bucket_2500ms = models.PositiveIntegerField(default=0)
+    bucket_5000ms = models.PositiveIntegerField(default=0)
+    bucket_inf = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.minute} - {self.method} - {self.view_metadata_id} - {self.status_code}: {self.count}"
+
+    class Meta:
+        verbose_name = 'Request Rollup'
+        verbose_name_plural = 'Request Rollups'
+        unique_together = ('minute', 'view_metadata', 'method', 'status_code')  # Also indexes the time range queries
+        indexes = [
+            models.Index(fields=['view_metadata', 'minute'], name='requestrollup_view_time_idx'),
+        ]
+
+
+class UserTrafficRollup(models.Model):
+    """
+    Requests per hour and authenticated user, maintained by the LogProcessor.
+    """
+    hour = models.DateTimeField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+    duration_sum_ms = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.hour} - {self.user_id}: {self.count}"
+
+    class Meta:
+        verbose_name = 'User Traffic Rollup'
+        verbose_name_plural = 'User Traffic Rollups'
+        unique_together = ('hour', 'user')  # Also indexes the time range queries
@@ -0,0 +1,118 @@
+from urllib.parse import urlencode
+from django.conf import settings
+
+# Request parameter capture modes of the RequestParamsCapture
+PARAMS_OFF = 'off'  # No parameters are logged, nor the query string of the URL
+PARAMS_QUERY = 'query'  # Only the query string parameters are logged
+PARAMS_CAPPED = 'capped'  # Query string and form parameters, if the view already parsed the body
+PARAMS_MODES = (PARAMS_OFF, PARAMS_QUERY, PARAMS_CAPPED)
+
+# Parameters whose name contains one of these (case insensitive) are logged redacted
+DEFAULT_REDACTED_PARAMS = (
+    'password', 'passwd', 'secret', 'token', 'api_key', 'apikey', 'authorization', 'sessionid', 'credit_card',
+    'card_number', 'cvv',
+)
+REDACTED_VALUE = '********'
+
+# Key added to the logged parameters when some were left out by the caps
+TRUNCATED_KEY = '_truncated'
+
+
+class RequestParamsCapture:
+    """
+    Decides which request parameters the SimpleLoggingMiddleware logs.
+
+    The request body is never read for logging: form parameters are only logged when the
+    view (or another middleware) already parsed it, so uploads aren't loaded in memory twice
+    and requests whose body is never parsed don't pay for it. The logged parameters are
+    capped in number and size, and sensitive ones are redacted.
+    """
+
+    def __init__(self, mode=PARAMS_CAPPED, max_keys=20, max_bytes=2048, redacted_params=DEFAULT_REDACTED_PARAMS):
+        """
+        :param mode: 'off', 'query' or 'capped'.
+        :param max_keys: Maximum number of parameters logged per request.
+        :param max_bytes: Maximum size of the logged parameter names and values, in bytes.
+        :param redacted_params: Substrings of the parameter names whose values are redacted.
+        """
+        if mode not in PARAMS_MODES:
+            raise ValueError(f"Invalid request params mode {mode!r}, expected one of {PARAMS_MODES}.")
+
+        self.mode = mode
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.redacted_params = tuple(name.lower() for name in redacted_params)
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Builds the capture from the LOG_REQUEST_PARAMS* settings.
+        """
+        return cls(
+            mode=getattr(settings, 'LOG_REQUEST_PARAMS', PARAMS_CAPPED),
+            max_keys=getattr(settings, 'LOG_REQUEST_PARAMS_MAX_KEYS', 20),
+            max_bytes=getattr(settings, 'LOG_REQUEST_PARAMS_MAX_BYTES', 2048),
+            redacted_params=getattr(settings, 'LOG_REDACTED_PARAMS', DEFAULT_REDACTED_PARAMS),
+        )
+
+    def get_full_path(self, request):
+        """
+        Returns the path and query string logged in the URL of the request: without query
+        string when parameters aren't logged, with the sensitive values redacted otherwise.
+        """
+        if self.mode == PARAMS_OFF or not request.META.get('QUERY_STRING'):
+            return request.path
+        if not any(self.is_redacted(key) for key in request.GET):
+            return request.get_full_path()
+
+        query = [
+            (key, REDACTED_VALUE if self.is_redacted(key) else value)
+            for key, values in request.GET.lists() for value in values
+        ]
+        return f"{request.path}?{urlencode(query, safe='*')}"
+
+    def capture(self, request):
+        """
+        Returns the parameters of the request to log, as a dict.
+        """
+        if self.mode == PARAMS_OFF:
+            return {}
+
+        params = request.GET.dict()
+        # Django caches the parsed body in _post, request.POST would read and parse it
+        if self.mode == PARAMS_CAPPED and request.method != 'GET' and '_post' in request.__dict__:
+            params.update(request.POST.dict())
+
+        return self.cap(params)
+
+    def cap(self, params):
+        """
+        Returns the parameters with the sensitive values redacted, cut to max_keys parameters
+        and max_bytes bytes.
+        """
+        capped = {}
+        remaining_bytes = self.max_bytes
+        for key, value in params.items():
+            if len(capped) >= self.max_keys:
+                capped[TRUNCATED_KEY] = True
+                break
+
+            if self.is_redacted(key):
+                value = REDACTED_VALUE
+
+            size = len(key.encode('utf-8')) + len(value.encode('utf-8'))
+            if size > remaining_bytes:
+                # Keep what fits of the value, the following parameters are left out
+                value_bytes = remaining_bytes - len(key.encode('utf-8'))
+                if value_bytes > 0:
+                    capped[key] = value.encode('utf-8')[:value_bytes].decode('utf-8', 'ignore')
+                capped[TRUNCATED_KEY] = True
+                break
+
+            capped[key] = value
+            remaining_bytes -= size
+        return capped
+
+    def is_redacted(self, key):
+        key = key.lower()
+        return any(name in key for name in self.redacted_params)
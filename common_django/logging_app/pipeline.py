@@ -0,0 +1,93 @@
+"""
+Generator stages of the LogProcessor ingestion pipeline:
+
+    read_lines -> parse_lines -> batched -> (LogProcessor writes each batch)
+
+Every stage pulls from the previous one only when the next stage asks for more, so at
+most one chunk of the file and one batch of entries are held in memory at any time,
+whatever the size of the file. Every item carries the file offset just past the line it
+comes from, so the writer knows how far the file has been stored once a batch is written.
+"""
+import logging
+
+# Logger shared with the log processor
+logger = logging.getLogger('log_processor')
+
+# Bytes read from a log file at a time
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Longest log line kept, longer lines are skipped so a corrupt file can't exhaust memory
+MAX_LINE_LENGTH = 1024 * 1024
+
+
+def read_lines(log_file, offset, chunk_size=READ_CHUNK_SIZE, max_line_length=MAX_LINE_LENGTH):
+    """
+    Yields (line, end_offset) for every complete line of the open (binary) log file,
+    starting at offset. A last line without a newline is still being written and is
+    left for the next run.
+    """
+    buffer = b''
+    # True while skipping the rest of a line that was too long
+    skipping = False
+
+    while True:
+        chunk = log_file.read(chunk_size)
+        if not chunk:
+            return
+
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end == -1:
+                break
+
+            line = buffer[start:end + 1]
+            offset += len(line)
+            start = end + 1
+
+            if skipping:
+                skipping = False
+                yield b'', offset
+            else:
+                yield line, offset
+
+        buffer = buffer[start:]
+        if len(buffer) > max_line_length:
+            logger.error(f"Skipping log line longer than {max_line_length} bytes at offset {offset}.")
+            offset += len(buffer)
+            buffer = b''
+            skipping = True
+
+
+def parse_lines(lines, parse_log):
+    """
+    Yields (log_data, end_offset) for every line, log_data is None for lines that can't be parsed.
+    """
+    for line, offset in lines:
+        if not line.strip():
+            yield None, offset
+            continue
+        yield parse_log(line.decode('utf-8', errors='replace')), offset
+
+
+def batched(records, batch_size):
+    """
+    Yields (batch, end_offset, line_count) with up to batch_size parsed entries, skipping
+    the entries that couldn't be parsed. The last batch may be empty if only unparsable
+    lines were left, so the offset still moves past them.
+    """
+    batch = []
+    line_count = 0
+    offset = None
+    for log_data, offset in records:
+        line_count += 1
+        if log_data:
+            batch.append(log_data)
+            if len(batch) >= batch_size:
+                yield batch, offset, line_count
+                batch = []
+                line_count = 0
+
+    if line_count:
+        yield batch, offset, line_count
@@ -0,0 +1,274 @@
+import os
+import sys
+import time
+import pstats
+import random
+import cProfile
+import logging
+import threading
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.utils.timezone import now
+
+# Logger for this module
+logger = logging.getLogger('log_processor')
+
+# Depth of the sampled stacks, innermost frames first
+STACK_DEPTH = 64
+
+
+class SqlStats:
+    """
+    Counts the SQL queries run by the current thread, and the time spent in them, through
+    an execute wrapper installed on every database connection.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self._wrappers = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start_time
+
+    def __enter__(self):
+        self._wrappers = ExitStack()
+        for connection in connections.all():
+            self._wrappers.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrappers.close()
+        self._wrappers = None
+
+
+class StackSampler:
+    """
+    Samples the stacks of the requests still running after slow_ms milliseconds, from a single
+    background thread, so the slow part of slow requests shows up without profiling all requests.
+    """
+
+    def __init__(self, slow_ms, interval):
+        self.slow_seconds = slow_ms / 1000
+        self.interval = interval
+        # Sampled stack counts and start time by thread id of the running requests
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def start(self, thread_id):
+        """
+        Starts sampling the request running in the thread once it turns slow.
+        """
+        if self._thread_pid != os.getpid():
+            self.start_thread()
+        with self._lock:
+            self._requests[thread_id] = (time.perf_counter(), Counter())
+
+    def stop(self, thread_id):
+        """
+        Stops sampling the request running in the thread, returns the counts of its sampled stacks.
+        """
+        with self._lock:
+            _, stacks = self._requests.pop(thread_id, (None, Counter()))
+        return stacks
+
+    def start_thread(self):
+        """
+        Starts the sampling thread, once per process so it survives a fork.
+        """
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            threading.Thread(target=self.run, name='request_stack_sampler', daemon=True).start()
+            self._thread_pid = os.getpid()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._requests:
+                    continue
+                current_time = time.perf_counter()
+                frames = sys._current_frames()
+                for thread_id, (start_time, stacks) in self._requests.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and current_time - start_time >= self.slow_seconds:
+                        stacks[format_stack(frame)] += 1
+
+
+def format_stack(frame):
+    """
+    Returns the stack of the frame in the collapsed format of flame graphs, outermost frame first.
+    """
+    labels = []
+    while frame is not None and len(labels) < STACK_DEPTH:
+        code = frame.f_code
+        labels.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def sanitize(label):
+    """
+    Removes the quotes of a profile label, which the legacy log record parser can't handle.
+    """
+    return label.replace("'", '').replace('"', '')
+
+
+class RequestMeasurement:
+    """
+    SQL statistics and profile of a single request, collected by RequestInstrumentation.measure().
+    """
+
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+        self.sql_stats = SqlStats() if instrumentation.sql_stats else None
+        self.profile = cProfile.Profile() if instrumentation.should_profile() else None
+        self.thread_id = threading.get_ident()
+        self.stacks = None
+
+    def __enter__(self):
+        if self.sql_stats is not None:
+            self.sql_stats.__enter__()
+        if self.profile is not None:
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is active (a single one is allowed at a time since Python 3.12)
+                self.profile = None
+        if self.profile is None and self.instrumentation.stack_sampler is not None:
+            self.instrumentation.stack_sampler.start(self.thread_id)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+        elif self.instrumentation.stack_sampler is not None:
+            self.stacks = self.instrumentation.stack_sampler.stop(self.thread_id)
+        if self.sql_stats is not None:
+            self.sql_stats.__exit__(*exc_info)
+
+    def get_log_fields(self):
+        """
+        Returns the fields added to the log records of the request: the SQL query count and
+        time, and the profile (or the path of its file) if the request was profiled.
+        """
+        fields = {}
+        if self.sql_stats is not None:
+            fields['sql_count'] = self.sql_stats.count
+            fields['sql_time_ms'] = round(self.sql_stats.time * 1000, 3)
+
+        if self.profile is not None:
+            fields['profile'] = self.instrumentation.save_profile(self.profile)
+        elif self.stacks:
+            fields['profile'] = self.instrumentation.save_stacks(self.stacks)
+        return fields
+
+
+class RequestInstrumentation:
+    """
+    Decides which requests the SimpleLoggingMiddleware instruments, all opt-in:
+    - The SQL queries of every request are counted and timed.
+    - A sample of the requests is profiled with cProfile.
+    - The stacks of the requests still running after a latency threshold are sampled.
+
+    Profiles are logged as a summary of the top functions or stacks, or written to a side file
+    whose path is logged instead. Only the requests handled by the sync middleware are
+    instrumented, under ASGI the queries run in other threads than the middleware.
+    """
+
+    def __init__(self, sql_stats=False, profile_sample_rate=0.0, profile_slow_ms=None, stack_interval=0.01,
+                 profile_top=30, profile_dir=None):
+        """
+        :param sql_stats: Count and time the SQL queries of every request.
+        :param profile_sample_rate: Fraction of the requests profiled with cProfile, between 0 and 1.
+        :param profile_slow_ms: Sample the stacks of the requests running for at least this many milliseconds.
+        :param stack_interval: Seconds between two stack samples.
+        :param profile_top: Number of functions or stacks kept in the logged profile summary.
+        :param profile_dir: Directory of the profile files, the profiles are logged as a summary if None.
+        """
+        self.sql_stats = sql_stats
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_top = profile_top
+        self.profile_dir = profile_dir
+        self.stack_sampler = StackSampler(profile_slow_ms, stack_interval) if profile_slow_ms is not None else None
+
+        self.enabled = sql_stats or profile_sample_rate > 0 or self.stack_sampler is not None
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Builds the instrumentation from the LOG_SQL_STATS and LOG_PROFILE_* settings.
+        """
+        return cls(
+            sql_stats=getattr(settings, 'LOG_SQL_STATS', False),
+            profile_sample_rate=getattr(settings, 'LOG_PROFILE_SAMPLE_RATE', 0.0),
+            profile_slow_ms=getattr(settings, 'LOG_PROFILE_SLOW_MS', None),
+            stack_interval=getattr(settings, 'LOG_PROFILE_STACK_INTERVAL', 0.01),
+            profile_top=getattr(settings, 'LOG_PROFILE_TOP', 30),
+            profile_dir=getattr(settings, 'LOG_PROFILE_DIR', None),
+        )
+
+    def should_profile(self):
+        return self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate
+
+    def measure(self):
+        """
+        Returns the context manager measuring a request, wrapped around the view.
+        """
+        return RequestMeasurement(self)
+
+    def save_profile(self, profile):
+        """
+        Returns the summary of the cProfile profile, the top functions by cumulative time,
+        or the path of the file it was written to.
+        """
+        if self.profile_dir is not None:
+            path = self.get_profile_path('prof')
+            try:
+                profile.dump_stats(path)
+                return path
+            except OSError as e:
+                logger.error(f"Error writing the request profile {path}: {e}")
+
+        stats = pstats.Stats(profile).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:self.profile_top]
+        lines = ['cumulative_ms own_ms calls function']
+        for (filename, line_number, function_name), (_, calls, own_time, cumulative_time, _) in rows:
+            label = sanitize(f"{os.path.basename(filename)}:{line_number}({function_name})")
+            lines.append(f"{cumulative_time * 1000:.3f} {own_time * 1000:.3f} {calls} {label}")
+        return '\n'.join(lines)
+
+    def save_stacks(self, stacks):
+        """
+        Returns the sampled stacks in the collapsed format of flame graphs (one stack and its
+        sample count per line), the top stacks only, or the path of the file they were written to.
+        """
+        if self.profile_dir is not None:
+            path = self.get_profile_path('folded')
+            try:
+                with open(path, 'w', encoding='utf-8') as profile_file:
+                    profile_file.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+                return path
+            except OSError as e:
+                logger.error(f"Error writing the request profile {path}: {e}")
+
+        return '\n'.join(
+            sanitize(f"{stack} {count}") for stack, count in stacks.most_common(self.profile_top)
+        )
+
+    def get_profile_path(self, extension):
+        """
+        Returns a new profile file path in the profile directory, which is created if needed.
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f"{now():%Y%m%dT%H%M%S%f}-{os.getpid()}-{threading.get_ident()}.{extension}"
+        return os.path.join(str(self.profile_dir), name)
@@ -0,0 +1,262 @@
+import re
+import logging
+from datetime import timedelta, datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from common_django.logging_app.models import RequestLog, RequestRollup, UserTrafficRollup
+
+# Logger shared with the scheduler
+logger = logging.getLogger('log_scheduler')
+
+# Number of days request logs are kept, None keeps them forever
+LOG_RETENTION_DAYS = getattr(settings, 'LOG_RETENTION_DAYS', None)
+
+# Number of days the rollups are kept, None keeps them forever
+LOG_ROLLUP_RETENTION_DAYS = getattr(settings, 'LOG_ROLLUP_RETENTION_DAYS', None)
+
+# Number of rows deleted per query and transaction
+LOG_RETENTION_CHUNK_SIZE = getattr(settings, 'LOG_RETENTION_CHUNK_SIZE', 5000)
+
+# 'daily' or 'monthly' when the request log table is partitioned by timestamp on PostgreSQL
+LOG_PARTITIONING = getattr(settings, 'LOG_PARTITIONING', None)
+
+# Number of upcoming partitions created ahead of time
+LOG_PARTITIONS_AHEAD = getattr(settings, 'LOG_PARTITIONS_AHEAD', 3)
+
+# Names of the partitions: <table>_pYYYYMMDD (daily) or <table>_pYYYYMM (monthly)
+PARTITION_SUFFIX_RE = re.compile(r'_p(\d{8}|\d{6})$')
+
+
+def prune_request_logs(retention_days=None, chunk_size=None, dry_run=False):
+    """
+    Delete the request logs older than the retention period and return the number of rows deleted.
+
+    On a partitioned table (see partition_table()), the upcoming partitions are created and the
+    expired ones dropped. Otherwise rows are deleted in chunks of consecutive primary keys, each
+    chunk in its own short transaction, so the table is never locked for long.
+    """
+    partitioned = LOG_PARTITIONING and is_partitioned()
+    if partitioned and not dry_run:
+        # Rows can only be inserted in an existing partition, create them whether or not logs expire
+        ensure_partitions()
+
+    retention_days = retention_days if retention_days is not None else LOG_RETENTION_DAYS
+    if retention_days is None:
+        logger.info("LOG_RETENTION_DAYS is not set, request logs are kept forever.")
+        return 0
+
+    chunk_size = chunk_size or LOG_RETENTION_CHUNK_SIZE
+    cutoff = timezone.now() - timedelta(days=retention_days)
+
+    if partitioned:
+        return drop_expired_partitions(cutoff, dry_run=dry_run)
+
+    expired_logs = RequestLog.objects.filter(timestamp__lt=cutoff)
+    if dry_run:
+        return expired_logs.count()
+
+    deleted = delete_in_chunks(expired_logs, chunk_size)
+    logger.info(f"Deleted {deleted} request logs older than {cutoff}.")
+    return deleted
+
+
+def prune_rollups(retention_days=None, chunk_size=None, dry_run=False):
+    """
+    Delete the request and user traffic rollups older than the rollup retention period, in chunks
+    like the request logs, and return the number of rows deleted.
+    """
+    retention_days = retention_days if retention_days is not None else LOG_ROLLUP_RETENTION_DAYS
+    if retention_days is None:
+        logger.info("LOG_ROLLUP_RETENTION_DAYS is not set, rollups are kept forever.")
+        return 0
+
+    chunk_size = chunk_size or LOG_RETENTION_CHUNK_SIZE
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    # Only the periods that ended before the cutoff
+    expired_rollups = [
+        RequestRollup.objects.filter(minute__lte=cutoff - timedelta(minutes=1)),
+        UserTrafficRollup.objects.filter(hour__lte=cutoff - timedelta(hours=1)),
+    ]
+    if dry_run:
+        return sum(rollups.count() for rollups in expired_rollups)
+
+    deleted = sum(delete_in_chunks(rollups, chunk_size) for rollups in expired_rollups)
+    logger.info(f"Deleted {deleted} rollups older than {cutoff}.")
+    return deleted
+
+
+def delete_in_chunks(queryset, chunk_size):
+    """
+    Delete the rows of the queryset in chunks of consecutive primary keys, each chunk in its
+    own transaction, and return the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+
+        with transaction.atomic():
+            count, _ = queryset.filter(pk__gte=pks[0], pk__lte=pks[-1]).delete()
+        deleted += count
+    return deleted
+
+
+def is_partitioned():
+    """
+    Returns True if the request log table is a partitioned table (PostgreSQL only).
+    """
+    if connection.vendor != 'postgresql':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s",
+            [RequestLog._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partitions():
+    """
+    Returns a dict of partition name -> (start, end) date range of the request log table.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [RequestLog._meta.db_table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_SUFFIX_RE.search(name)
+        if match:
+            partitions[name] = partition_range(match.group(1))
+    return partitions
+
+
+def partition_range(suffix):
+    """
+    Returns the (start, end) datetimes covered by the partition with the given date suffix.
+    """
+    if len(suffix) == 8:
+        start = datetime.strptime(suffix, '%Y%m%d').replace(tzinfo=dt_timezone.utc)
+        return start, start + timedelta(days=1)
+
+    start = datetime.strptime(suffix, '%Y%m').replace(tzinfo=dt_timezone.utc)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def ensure_partitions(partitions_ahead=None, start=None, end=None):
+    """
+    Create the partitions from the period of start (the current period by default) up to the
+    period of end, or now, and the next partitions_ahead periods, if missing.
+    """
+    partitions_ahead = partitions_ahead if partitions_ahead is not None else LOG_PARTITIONS_AHEAD
+    table = RequestLog._meta.db_table
+    end = max(end or timezone.now(), timezone.now())
+
+    start = (start or end).astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if LOG_PARTITIONING == 'monthly':
+        start = start.replace(day=1)
+
+    with connection.cursor() as cursor:
+        ahead = 0
+        while ahead <= partitions_ahead:
+            suffix = start.strftime('%Y%m' if LOG_PARTITIONING == 'monthly' else '%Y%m%d')
+            start, period_end = partition_range(suffix)
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}_p{suffix}" PARTITION OF "{table}" '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [start, period_end],
+            )
+            if period_end > end:
+                ahead += 1
+            start = period_end
+
+
+def partition_table():
+    """
+    Convert the request log table into a table partitioned by timestamp (LOG_PARTITIONING),
+    copying every row into the partition of its period. PostgreSQL only.
+
+    Unique constraints of a partitioned table must include the timestamp, so the primary key
+    becomes (id, timestamp) and the unique log_key (log_key, timestamp). The log_key is a hash
+    of the timestamp among other fields, so duplicates are still rejected. The table is locked
+    while the rows are copied, stop the ingestion first.
+    """
+    if connection.vendor != 'postgresql':
+        raise ValueError("Only PostgreSQL request log tables can be partitioned.")
+    if LOG_PARTITIONING not in ('daily', 'monthly'):
+        raise ValueError(f"Invalid LOG_PARTITIONING {LOG_PARTITIONING!r}, expected 'daily' or 'monthly'.")
+    if is_partitioned():
+        return False
+
+    table = RequestLog._meta.db_table
+    old_table = f"{table}_unpartitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old_table}"')
+
+        # Indexes and foreign keys are recreated on the partitioned table under the same names
+        cursor.execute(
+            "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+            "WHERE indrelid = %s::regclass AND NOT indisprimary AND NOT indisunique",
+            [old_table],
+        )
+        index_definitions = [row[0].replace(f'.{old_table} ', f'.{table} ') for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [old_table],
+        )
+        foreign_keys = cursor.fetchall()
+
+        # Check and not null constraints are copied, the id sequence is replaced below
+        cursor.execute(f'CREATE TABLE "{table}" (LIKE "{old_table}" INCLUDING CONSTRAINTS) PARTITION BY RANGE ("timestamp")')
+        cursor.execute(f'SELECT MIN("timestamp"), MAX("timestamp") FROM "{old_table}"')
+        first_timestamp, last_timestamp = cursor.fetchone()
+        ensure_partitions(start=first_timestamp, end=last_timestamp)
+
+        cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{old_table}"')
+        copied = cursor.rowcount
+        cursor.execute(f'DROP TABLE "{old_table}"')
+
+        cursor.execute(f'CREATE SEQUENCE "{table}_id_seq" OWNED BY "{table}"."id"')
+        cursor.execute(f'SELECT setval(%s, COALESCE(MAX("id"), 0) + 1, false) FROM "{table}"', [f'"{table}_id_seq"'])
+        cursor.execute(f'ALTER TABLE "{table}" ALTER COLUMN "id" SET DEFAULT nextval(%s)', [f'"{table}_id_seq"'])
+
+        cursor.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY ("id", "timestamp")')
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_log_key_timestamp_uniq" UNIQUE ("log_key", "timestamp")')
+        for index_definition in index_definitions:
+            cursor.execute(index_definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+
+    logger.info(f"Partitioned {table} ({LOG_PARTITIONING}), {copied} request logs copied.")
+    return True
+
+
+def drop_expired_partitions(cutoff, dry_run=False):
+    """
+    Drop the partitions only holding request logs older than the cutoff, returns the (estimated) number of rows dropped.
+    Rows of a partially expired partition are kept until the whole partition expires.
+    """
+    dropped = 0
+    with connection.cursor() as cursor:
+        for name, (start, end) in sorted(get_partitions().items()):
+            if end > cutoff:
+                continue
+
+            # The planner's row estimate avoids scanning the whole partition
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [name])
+            dropped += max(cursor.fetchone()[0], 0)
+            if not dry_run:
+                cursor.execute(f'DROP TABLE "{name}"')
+                logger.info(f"Dropped request log partition {name} ({start} - {end}).")
+
+    return dropped
@@ -0,0 +1,192 @@
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+from django.conf import settings
+from django.db.models import F, Sum, Max, Value
+from django.db.models.functions import Greatest
+from common_django.logging_app.models import RequestRollup, UserTrafficRollup
+
+# Maintain the rollup tables while ingesting request logs
+LOG_ROLLUPS_ENABLED = getattr(settings, 'LOG_ROLLUPS_ENABLED', True)
+
+# Upper bounds (in ms) of the latency buckets and the RequestRollup column counting each of them,
+# slower requests are counted in bucket_inf
+LATENCY_BUCKETS_MS = (
+    (10, 'bucket_10ms'),
+    (25, 'bucket_25ms'),
+    (50, 'bucket_50ms'),
+    (100, 'bucket_100ms'),
+    (250, 'bucket_250ms'),
+    (500, 'bucket_500ms'),
+    (1000, 'bucket_1000ms'),
+    (2500, 'bucket_2500ms'),
+    (5000, 'bucket_5000ms'),
+    (float('inf'), 'bucket_inf'),
+)
+BUCKET_FIELDS = [field for _, field in LATENCY_BUCKETS_MS]
+
+REQUEST_ROLLUP_KEY = ('minute', 'view_metadata_id', 'method', 'status_code')
+USER_ROLLUP_KEY = ('hour', 'user_id')
+
+
+def get_bucket_field(duration_ms):
+    """
+    Returns the RequestRollup column counting requests of the given duration.
+    """
+    for upper_bound, field in LATENCY_BUCKETS_MS:
+        if duration_ms <= upper_bound:
+            return field
+    return 'bucket_inf'
+
+
+def update_rollups(log_entries):
+    """
+    Add the RequestLog entries to the rollup tables, to be called in the transaction inserting
+    them once they are inserted, so that only the stored entries are counted, and only once.
+    Only entries with a status code (response or combined records) are counted.
+    """
+    if not LOG_ROLLUPS_ENABLED:
+        return
+
+    request_rollups = defaultdict(lambda: defaultdict(int))
+    user_rollups = defaultdict(lambda: defaultdict(int))
+    for log_entry in log_entries:
+        if log_entry.status_code is None or log_entry.view_metadata_id is None:
+            continue
+
+        timestamp = log_entry.timestamp.astimezone(dt_timezone.utc)
+        minute = timestamp.replace(second=0, microsecond=0)
+        duration_ms = log_entry.duration_ms
+
+        request_rollup = request_rollups[(minute, log_entry.view_metadata_id, log_entry.method, log_entry.status_code)]
+        request_rollup['count'] += 1
+        if duration_ms is not None:
+            request_rollup['duration_count'] += 1
+            request_rollup['duration_sum_ms'] += duration_ms
+            request_rollup['duration_max_ms'] = max(request_rollup['duration_max_ms'], duration_ms)
+            request_rollup[get_bucket_field(duration_ms)] += 1
+
+        if log_entry.user_id is not None:
+            user_rollup = user_rollups[(minute.replace(minute=0), log_entry.user_id)]
+            user_rollup['count'] += 1
+            user_rollup['duration_sum_ms'] += duration_ms or 0
+
+    upsert_rollups(RequestRollup, REQUEST_ROLLUP_KEY, request_rollups)
+    upsert_rollups(UserTrafficRollup, USER_ROLLUP_KEY, user_rollups)
+
+
+def get_sort_key(key):
+    """
+    Returns a sort key for a rollup key, whose values may be None.
+    """
+    return [(value is None, value) for value in key]
+
+
+def upsert_rollups(model, key_fields, increments):
+    """
+    Add the increments (dict of field values by key) to the rollup rows with the given keys.
+    Missing rows are created empty first, ignoring rows created concurrently by another
+    ingester, then every row is incremented in place so concurrent updates add up.
+    Rows are locked in the same (key) order by every ingester, so concurrent transactions
+    wait for each other instead of deadlocking.
+    """
+    if not increments:
+        return
+
+    keys = sorted(increments, key=get_sort_key)
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in keys],
+        ignore_conflicts=True,
+    )
+    for key in keys:
+        updates = {
+            field: Greatest(F(field), Value(value)) if field == 'duration_max_ms' else F(field) + value
+            for field, value in increments[key].items()
+        }
+        model.objects.filter(**dict(zip(key_fields, key))).update(**updates)
+
+
+def view_traffic(start, end, app_name=None, view=None, method=None, status_code=None):
+    """
+    Returns the number of requests and the average duration per minute and view between start
+    and end, as a list of dicts ordered by minute.
+    """
+    rollups = filter_request_rollups(start, end, app_name, view, method, status_code)
+    rows = (
+        rollups.values('minute', 'view_metadata__app_name', 'view_metadata__view')
+        .annotate(count=Sum('count'), duration_count=Sum('duration_count'), duration_sum_ms=Sum('duration_sum_ms'))
+        .order_by('minute', 'view_metadata__app_name', 'view_metadata__view')
+    )
+    return [
+        {
+            'minute': row['minute'],
+            'app_name': row['view_metadata__app_name'],
+            'view': row['view_metadata__view'],
+            'count': row['count'],
+            'avg_duration_ms': row['duration_sum_ms'] / row['duration_count'] if row['duration_count'] else None,
+        }
+        for row in rows
+    ]
+
+
+def latency_histogram(start, end, app_name=None, view=None, method=None, status_code=None):
+    """
+    Returns the latency histogram of the requests between start and end, as a dict with the
+    request count by bucket upper bound (ms) and the max duration.
+    """
+    rollups = filter_request_rollups(start, end, app_name, view, method, status_code)
+    totals = rollups.aggregate(duration_max_ms=Max('duration_max_ms'), **{field: Sum(field) for field in BUCKET_FIELDS})
+    return {
+        'buckets': {upper_bound: totals[field] or 0 for upper_bound, field in LATENCY_BUCKETS_MS},
+        'max_ms': totals['duration_max_ms'],
+    }
+
+
+def latency_percentile(histogram, percentile):
+    """
+    Returns the upper bound of the latency bucket holding the given percentile (0-100) of a
+    histogram returned by latency_histogram(), or None if it is empty.
+    """
+    buckets = histogram['buckets']
+    total = sum(buckets.values())
+    if not total:
+        return None
+
+    seen = 0
+    for upper_bound, count in buckets.items():
+        seen += count
+        if seen >= total * percentile / 100:
+            return upper_bound if upper_bound != float('inf') else histogram['max_ms']
+    return histogram['max_ms']
+
+
+def top_users(start, end, limit=10):
+    """
+    Returns the users with the most requests between start and end, as a list of dicts.
+    The user rollups are hourly, so start is rounded down to the hour.
+    """
+    rows = (
+        UserTrafficRollup.objects.filter(hour__gte=start.replace(minute=0, second=0, microsecond=0), hour__lt=end)
+        .values('user_id', 'user__email')
+        .annotate(count=Sum('count'), duration_sum_ms=Sum('duration_sum_ms'))
+        .order_by('-count')[:limit]
+    )
+    return [
+        {'user_id': row['user_id'], 'email': row['user__email'], 'count': row['count'], 'duration_sum_ms': row['duration_sum_ms']}
+        for row in rows
+    ]
+
+
+def filter_request_rollups(start, end, app_name=None, view=None, method=None, status_code=None):
+    """
+    Returns the RequestRollup rows between start (included) and end (excluded) matching the filters.
+    """
+    rollups = RequestRollup.objects.filter(minute__gte=start.replace(second=0, microsecond=0), minute__lt=end)
+    if app_name is not None:
+        rollups = rollups.filter(view_metadata__app_name=app_name)
+    if view is not None:
+        rollups = rollups.filter(view_metadata__view=view)
+    if method is not None:
+        rollups = rollups.filter(method=method)
+    if status_code is not None:
+        rollups = rollups.filter(status_code=status_code)
+    return rollups
@@ -0,0 +1,85 @@
+import re
+import random
+from django.conf import settings
+
+
+class LoggingRules:
+    """
+    Decides which requests are logged by the SimpleLoggingMiddleware.
+
+    The rules are compiled once when the middleware is created so checking them costs
+    next to nothing per request:
+    - Requests to excluded URL prefixes or patterns, or with an excluded method, are never logged.
+    - Other requests are sampled at the per-view or default sample rate.
+    - Sampled out requests are still logged on a server error or when slower than the threshold.
+    """
+
+    def __init__(self, exclude_paths=(), exclude_patterns=(), exclude_methods=(), sample_rate=1.0,
+                 view_sample_rates=None, always_log_errors=True, slow_request_ms=None):
+        """
+        :param exclude_paths: URL path prefixes that are never logged (e.g. '/static/').
+        :param exclude_patterns: Regular expressions of URL paths that are never logged (e.g. r'^/health/?$').
+        :param exclude_methods: HTTP methods that are never logged (e.g. 'OPTIONS').
+        :param sample_rate: Fraction of the requests logged, between 0 and 1.
+        :param view_sample_rates: Sample rates by view name, overriding sample_rate.
+        :param always_log_errors: Log sampled out requests that failed with a server error (5xx).
+        :param slow_request_ms: Log sampled out requests that took at least this many milliseconds.
+        """
+        self.exclude_paths = tuple(exclude_paths)
+        self.exclude_pattern = re.compile('|'.join(f'(?:{pattern})' for pattern in exclude_patterns)) if exclude_patterns else None
+        self.exclude_methods = frozenset(method.upper() for method in exclude_methods)
+        self.sample_rate = sample_rate
+        self.view_sample_rates = dict(view_sample_rates or {})
+        self.always_log_errors = always_log_errors
+        self.slow_request_ms = slow_request_ms
+
+        # Sampling needs the response to be known before deciding whether to log the request
+        self.samples = sample_rate < 1 or any(rate < 1 for rate in self.view_sample_rates.values())
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Builds the rules from the LOG_* settings.
+        """
+        return cls(
+            exclude_paths=getattr(settings, 'LOG_EXCLUDE_PATHS', ()),
+            exclude_patterns=getattr(settings, 'LOG_EXCLUDE_PATTERNS', ()),
+            exclude_methods=getattr(settings, 'LOG_EXCLUDE_METHODS', ()),
+            sample_rate=getattr(settings, 'LOG_SAMPLE_RATE', 1.0),
+            view_sample_rates=getattr(settings, 'LOG_VIEW_SAMPLE_RATES', None),
+            always_log_errors=getattr(settings, 'LOG_ALWAYS_LOG_ERRORS', True),
+            slow_request_ms=getattr(settings, 'LOG_SLOW_REQUEST_MS', None),
+        )
+
+    def is_excluded(self, request):
+        """
+        Returns True if the request must not be logged at all, based on its path and method.
+        """
+        if request.method in self.exclude_methods:
+            return True
+
+        path = request.path_info
+        if self.exclude_paths and path.startswith(self.exclude_paths):
+            return True
+        if self.exclude_pattern is not None and self.exclude_pattern.search(path):
+            return True
+
+        return False
+
+    def should_log(self, request, response, duration_ms):
+        """
+        Returns True if the (not excluded) request is logged once its response is known.
+        """
+        if not self.samples:
+            return True
+
+        if self.always_log_errors and response.status_code >= 500:
+            return True
+        if self.slow_request_ms is not None and duration_ms >= self.slow_request_ms:
+            return True
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = resolver_match.view_name if resolver_match else None
+        sample_rate = self.view_sample_rates.get(view_name, self.sample_rate)
+
+        return sample_rate >= 1 or random.random() < sample_rate
@@ -1,10 +1,21 @@
-import os
-import django
-import sys
-import schedule
 import time
+import schedule
+import threading
 import logging
+from django.conf import settings
+from django.db import close_old_connections, DatabaseError
 from common_django.logging_app.log_processor import LogProcessor  # Import your class-based log processor
+from common_django.logging_app.retention import (
+    LOG_RETENTION_DAYS, LOG_ROLLUP_RETENTION_DAYS, LOG_PARTITIONING, prune_request_logs, prune_rollups,
+)
+from common_django.logging_app.locks import get_scheduler_lock
+from common_django.logging_app.metrics import get_metrics
+
+# Time of day the expired request logs are deleted, when LOG_RETENTION_DAYS is set
+LOG_RETENTION_TIME = getattr(settings, 'LOG_RETENTION_TIME', '03:00')
+
+# Seconds between attempts to take the scheduler lock while another process holds it
+LOG_SCHEDULER_LOCK_RETRY = getattr(settings, 'LOG_SCHEDULER_LOCK_RETRY', 60)
 
 # Set up logger
 logger = logging.getLogger('log_scheduler')
@@ -24,39 +35,109 @@ class LogScheduler:
         self.interval = interval
         self.timezone = timezone
         self.processor = LogProcessor()  # Instantiate the LogProcessor class
-        self.start()
+
+        # Jobs are registered on a scheduler of our own, not on the global one of the schedule module
+        self.scheduler = schedule.Scheduler()
+        # Only one process (per host or per database, see LOG_SCHEDULER_LOCK) runs the jobs
+        self.lock = get_scheduler_lock()
+        self._stop_event = threading.Event()
+        # Held while a job runs, so a job is never started while another one is still running
+        self._job_lock = threading.Lock()
+        self.schedule_job()
 
     def start(self):
         """
-        Start the log processing scheduler based on the specified conditions.
-        """
-        # Schedule the job based on the frequency
-        self.schedule_job()
+        Run the scheduled jobs until stop() is called, blocking the calling thread.
 
+        The scheduler sleeps until the next job is due instead of polling. While another process
+        holds the scheduler lock, or while the database of the lock is unreachable, it stays on
+        standby and tries to take over every LOG_SCHEDULER_LOCK_RETRY seconds.
+        """
         logger.info("Scheduler started. Processing logs based on the specified schedule...")
+        is_leader = False
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    acquired = self.lock.acquire()
+                except DatabaseError as e:
+                    # The database (of the advisory lock) is unreachable, stand by and retry
+                    logger.error(f"Error taking the scheduler lock: {e}")
+                    close_old_connections()
+                    acquired = False
+
+                if not acquired:
+                    if is_leader:
+                        logger.warning("Lost the scheduler lock, standing by.")
+                    is_leader = False
+                    self._stop_event.wait(LOG_SCHEDULER_LOCK_RETRY)
+                    continue
+
+                if not is_leader:
+                    logger.info("Acquired the scheduler lock, running the scheduled jobs.")
+                    is_leader = True
+
+                self.scheduler.run_pending()
 
-        # Continuously run pending jobs
-        while True:
-            schedule.run_pending()
-            time.sleep(1)  # Sleep for a second between checks
+                # Sleep until the next job is due, waking up early if stopped. Long sleeps are cut
+                # short to check the lock is still held (its database connection may be lost).
+                idle_seconds = self.scheduler.idle_seconds
+                if idle_seconds is None:
+                    idle_seconds = LOG_SCHEDULER_LOCK_RETRY
+                self._stop_event.wait(min(max(idle_seconds, 0), LOG_SCHEDULER_LOCK_RETRY))
+        finally:
+            self.lock.release()
+            logger.info("Scheduler stopped.")
+
+    def stop(self):
+        """
+        Stop the scheduler, a running job is finished first.
+        """
+        self._stop_event.set()
 
     def schedule_job(self):
         """
         Schedule the job based on the specified frequency and conditions.
         """
         if self.frequency == 'seconds' and self.interval:
-            schedule.every(self.interval).seconds.do(self.log_processor_task)
+            self.scheduler.every(self.interval).seconds.do(self.run_job, self.log_processor_task)
         elif self.frequency == 'minutes' and self.interval:
-            schedule.every(self.interval).minutes.do(self.log_processor_task)
+            self.scheduler.every(self.interval).minutes.do(self.run_job, self.log_processor_task)
         elif self.frequency == 'hour':
-            schedule.every().hour.do(self.log_processor_task)
+            self.scheduler.every().hour.do(self.run_job, self.log_processor_task)
         elif self.frequency == 'daily' and self.job_time:
-            schedule.every().day.at(self.job_time).do(self.log_processor_task)
+            self.scheduler.every().day.at(self.job_time).do(self.run_job, self.log_processor_task)
         elif self.frequency == 'weekly' and self.job_time:
-            schedule.every().week.at(self.job_time).do(self.log_processor_task)
+            self.scheduler.every().week.at(self.job_time).do(self.run_job, self.log_processor_task)
         else:
             logger.warning("Invalid scheduling conditions provided.")
 
+        # Expired request logs are deleted (and upcoming partitions created) once a day, outside of
+        # the log processing schedule
+        if LOG_RETENTION_DAYS is not None or LOG_ROLLUP_RETENTION_DAYS is not None or LOG_PARTITIONING:
+            self.scheduler.every().day.at(LOG_RETENTION_TIME).do(self.run_job, self.retention_task)
+
+    def run_job(self, job):
+        """
+        Run a scheduled job unless another one is still running. Errors are logged so that
+        a failing job doesn't stop the scheduler.
+        """
+        if not self._job_lock.acquire(blocking=False):
+            logger.warning(f"Skipping {job.__name__}, the previous job is still running.")
+            return
+
+        start_time = time.perf_counter()
+        try:
+            # Don't reuse a database connection that timed out since the previous run
+            close_old_connections()
+            job()
+        except Exception as e:
+            get_metrics().inc('request_log_job_failures_total', job=job.__name__)
+            logger.exception(f"Error running {job.__name__}: {e}")
+        finally:
+            get_metrics().observe('request_log_job_seconds', time.perf_counter() - start_time, job=job.__name__)
+            close_old_connections()
+            self._job_lock.release()
+
     def log_processor_task(self):
         """
         The scheduled task that will run to process logs.
@@ -64,3 +145,12 @@ class LogScheduler:
         logger.info("Starting log processing task...")
         self.processor.run()  # Execute the run method
         logger.info("Log processing task completed.")
+
+    def retention_task(self):
+        """
+        The scheduled task that will run to delete the expired request logs and rollups.
+        """
+        logger.info("Starting request log retention task...")
+        prune_request_logs()
+        prune_rollups()
+        logger.info("Request log retention task completed.")
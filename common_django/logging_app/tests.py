@@ -0,0 +1,565 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, OperationalError
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from common_django.logging_app import log_processor, pipeline, retention, views
+from common_django.logging_app.checkpoint import CheckpointStore
+from common_django.logging_app.handlers import RequestLogDatabaseHandler, RequestLogQueueHandler
+from common_django.logging_app.middleware import SimpleLoggingMiddleware
+from common_django.logging_app.log_processor import LogProcessor
+from common_django.logging_app.params import REDACTED_VALUE, TRUNCATED_KEY, RequestParamsCapture
+from common_django.logging_app.schedular import LogScheduler
+from common_django.logging_app.models import RequestLog, RequestRollup, UserTrafficRollup, ViewMetadata
+
+
+def order_detail(request, number):
+    return HttpResponse('ok')
+
+
+# URLs of the middleware tests
+urlpatterns = [
+    path('orders/<int:number>/', order_detail, name='order-detail'),
+]
+
+
+def write_log_file(path, size):
+    """
+    Writes a log file of JSON lines of at least size bytes, returns the number of lines.
+    """
+    line_count = 0
+    written = 0
+    with open(path, 'wb') as log_file:
+        while written < size:
+            line = json.dumps({'id': line_count, 'url': f'/orders/{line_count}/', 'padding': 'x' * 200}).encode() + b'\n'
+            log_file.write(line)
+            written += len(line)
+            line_count += 1
+    return line_count
+
+
+def build_log_data(number, **fields):
+    """
+    Returns the structured response record of a request as logged by the SimpleLoggingMiddleware.
+    """
+    log_data = {
+        'timestamp': (timezone.now() - timedelta(minutes=number)).isoformat(timespec='microseconds'),
+        'status_code': 200,
+        'url': f'http://testserver/orders/{number}/',
+        'method': 'GET',
+        'user': None,
+        'user_id': None,
+        'remote_ip': '127.0.0.1',
+        'duration_ms': 12.5,
+        'app_name': 'orders',
+        'view': 'order-detail',
+        'class_name': 'Unknown',
+        'function_name': 'order_detail',
+        'line_number': 10,
+    }
+    log_data.update(fields)
+    return log_data
+
+
+def build_log_record(number, **fields):
+    """
+    Returns a JSON response record line as written to the log file.
+    """
+    return f"2024-10-04 07:19:00,123 [middleware | INFO] Response: {json.dumps(build_log_data(number, **fields))}\n"
+
+
+def read_all(log_file_path, offset=0):
+    """
+    Returns the lines of the log file from offset through read_lines, and the offset reached.
+    """
+    lines = []
+    with open(log_file_path, 'rb') as log_file:
+        log_file.seek(offset)
+        for line, offset in pipeline.read_lines(log_file, offset):
+            lines.append(line)
+    return lines, offset
+
+
+class PipelineMemoryTest(SimpleTestCase):
+    # Peak memory allowed while streaming a file, whatever its size (under 3 MiB measured)
+    MAX_PEAK_BYTES = 8 * 1024 * 1024
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def stream(self, size):
+        """
+        Streams a generated log file of size bytes through the pipeline under tracemalloc, checks
+        every line was parsed and returns the peak memory.
+        """
+        log_file_path = os.path.join(self.directory, f'request_logs_{size}.log')
+        line_count = write_log_file(log_file_path, size)
+
+        entry_count = 0
+        tracemalloc.start()
+        try:
+            with open(log_file_path, 'rb') as log_file:
+                lines = pipeline.read_lines(log_file, 0)
+                records = pipeline.parse_lines(lines, json.loads)
+                for batch, _, _ in pipeline.batched(records, 500):
+                    entry_count += len(batch)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(entry_count, line_count)
+        return peak
+
+    def test_peak_memory_is_bounded(self):
+        small_peak = self.stream(4 * pipeline.READ_CHUNK_SIZE)
+        large_peak = self.stream(16 * pipeline.READ_CHUNK_SIZE)
+
+        self.assertLess(small_peak, self.MAX_PEAK_BYTES)
+        self.assertLess(large_peak, self.MAX_PEAK_BYTES)
+
+
+class CheckpointTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.log_file_path = os.path.join(self.directory, 'request_logs.log')
+        self.checkpoints = CheckpointStore(os.path.join(self.directory, 'request_logs.checkpoint.json'))
+
+    def write(self, path, content, mode='wb'):
+        with open(path, mode) as log_file:
+            log_file.write(content)
+
+    def save_checkpoint(self, path, offset):
+        with open(path, 'rb') as log_file:
+            self.checkpoints.save(path, self.checkpoints.build_checkpoint(log_file, offset))
+
+    def resume_offset(self, path):
+        with open(path, 'rb') as log_file:
+            return self.checkpoints.resume_offset(path, log_file)
+
+    def test_resumes_after_the_stored_offset(self):
+        self.write(self.log_file_path, b'first\nsecond\n')
+        _, offset = read_all(self.log_file_path)
+        self.save_checkpoint(self.log_file_path, offset)
+        self.write(self.log_file_path, b'third\n', 'ab')
+
+        offset = self.resume_offset(self.log_file_path)
+        self.assertEqual(read_all(self.log_file_path, offset)[0], [b'third\n'])
+
+    def test_partial_last_line_is_read_once_complete(self):
+        self.write(self.log_file_path, b'first\nsec')
+        lines, offset = read_all(self.log_file_path)
+        self.assertEqual(lines, [b'first\n'])
+        self.assertEqual(offset, len(b'first\n'))
+        self.save_checkpoint(self.log_file_path, offset)
+
+        self.write(self.log_file_path, b'ond\n', 'ab')
+        offset = self.resume_offset(self.log_file_path)
+        self.assertEqual(read_all(self.log_file_path, offset)[0], [b'second\n'])
+
+    def test_truncated_file_is_read_from_the_start(self):
+        self.write(self.log_file_path, b'first\nsecond\n')
+        self.save_checkpoint(self.log_file_path, len(b'first\nsecond\n'))
+
+        self.write(self.log_file_path, b'new\n')
+        self.assertEqual(self.resume_offset(self.log_file_path), 0)
+
+    def test_rotated_file_resumes_its_checkpoint(self):
+        old_content = b''.join(f'old line {number}\n'.encode() for number in range(20))
+        self.write(self.log_file_path, old_content)
+        self.save_checkpoint(self.log_file_path, len(old_content))
+
+        # Rotated: renamed, and a new log file started in its place
+        rotated_path = f'{self.log_file_path}.1'
+        os.rename(self.log_file_path, rotated_path)
+        self.write(rotated_path, b'last old line\n', 'ab')
+        self.write(self.log_file_path, b''.join(f'new line {number}\n'.encode() for number in range(20)))
+
+        offset = self.resume_offset(rotated_path)
+        self.assertEqual(offset, len(old_content))
+        self.assertEqual(read_all(rotated_path, offset)[0], [b'last old line\n'])
+        self.assertEqual(self.resume_offset(self.log_file_path), 0)
+
+
+class LogProcessorTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.log_file_path = os.path.join(self.directory, 'request_logs.log')
+        self.processor = LogProcessor(
+            self.log_file_path, os.path.join(self.directory, 'request_logs.checkpoint.json'), batch_size=500,
+            workers=1, seed_checkpoints=False,
+        )
+        # Ids of views created in the transactions of other tests
+        log_processor.view_metadata_ids.clear()
+        self.addCleanup(log_processor.view_metadata_ids.clear)
+
+    def write_records(self, count):
+        with open(self.log_file_path, 'a') as log_file:
+            log_file.writelines(build_log_record(number) for number in range(count))
+
+    def get_offset(self):
+        checkpoint = self.processor.checkpoints.get(self.log_file_path)
+        return checkpoint['offset'] if checkpoint else 0
+
+    def test_database_outage_keeps_the_batch(self):
+        self.write_records(5)
+        with mock.patch.object(RequestLog.objects, 'bulk_create', side_effect=OperationalError('server closed the connection')), \
+                self.assertLogs('log_processor', 'ERROR'):
+            self.processor.process_log_file(self.log_file_path)
+
+        self.assertEqual(RequestLog.objects.count(), 0)
+        self.assertEqual(self.get_offset(), 0)
+
+        self.processor.process_log_file(self.log_file_path)
+        self.assertEqual(RequestLog.objects.count(), 5)
+        self.assertEqual(self.get_offset(), os.path.getsize(self.log_file_path))
+
+    def test_rejected_batch_is_saved_row_by_row(self):
+        self.write_records(5)
+        with mock.patch.object(RequestLog.objects, 'bulk_create', side_effect=IntegrityError('duplicate key')), \
+                self.assertLogs('log_processor', 'WARNING'):
+            self.processor.process_log_file(self.log_file_path)
+
+        self.assertEqual(RequestLog.objects.count(), 5)
+        self.assertEqual(self.get_offset(), os.path.getsize(self.log_file_path))
+
+    def test_batch_is_kept_when_every_row_fails(self):
+        self.write_records(5)
+        with mock.patch.object(RequestLog.objects, 'bulk_create', side_effect=IntegrityError('duplicate key')), \
+                mock.patch.object(RequestLog, 'save', side_effect=IntegrityError('duplicate key')), \
+                self.assertLogs('log_processor', 'ERROR'):
+            self.processor.process_log_file(self.log_file_path)
+
+        self.assertEqual(RequestLog.objects.count(), 0)
+        self.assertEqual(self.get_offset(), 0)
+
+    def test_reingested_file_is_not_counted_twice(self):
+        user = User.objects.create(username='rollups', email='rollups@example.com')
+        with open(self.log_file_path, 'a') as log_file:
+            log_file.writelines(build_log_record(number, user=user.username, user_id=user.id) for number in range(5))
+        self.processor.process_log_file(self.log_file_path)
+
+        # Without a checkpoint the file is read again from the start
+        processor = LogProcessor(
+            self.log_file_path, os.path.join(self.directory, 'other.checkpoint.json'), batch_size=500, workers=1,
+            seed_checkpoints=False,
+        )
+        processor.process_log_file(self.log_file_path)
+
+        self.assertEqual(RequestLog.objects.count(), 5)
+        self.assertEqual(RequestRollup.objects.aggregate(total=Sum('count'))['total'], 5)
+        self.assertEqual(UserTrafficRollup.objects.aggregate(total=Sum('count'))['total'], 5)
+
+
+class RequestLogQueueHandlerTest(SimpleTestCase):
+
+    def test_stop_with_a_full_queue(self):
+        # A target stuck writing the first record, so the queue stays full
+        writing = threading.Event()
+        unblock = threading.Event()
+        target = logging.Handler()
+        target.emit = lambda record: (writing.set(), unblock.wait())
+        self.addCleanup(unblock.set)
+
+        handler = RequestLogQueueHandler(target=target, maxsize=1)
+        handler.emit(logging.makeLogRecord({'msg': 'Response: 0', 'levelno': logging.INFO}))
+        self.assertTrue(writing.wait(5))
+        handler.emit(logging.makeLogRecord({'msg': 'Response: 1', 'levelno': logging.INFO}))
+        handler._listener.timeout = 0.1
+
+        handler.stop()
+
+        self.assertEqual(handler.dropped_records, 1)
+
+
+class RequestLogDatabaseHandlerTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.fallback_path = os.path.join(self.directory, 'request_logs.log')
+        self.handler = RequestLogDatabaseHandler(fallback_filename=self.fallback_path)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.addCleanup(self.handler.close)
+        log_processor.view_metadata_ids.clear()
+        self.addCleanup(log_processor.view_metadata_ids.clear)
+
+    def build_records(self, count):
+        return [
+            logging.makeLogRecord({'msg': f'Response: {number}', 'levelno': logging.INFO, 'log_data': build_log_data(number)})
+            for number in range(count)
+        ]
+
+    def read_fallback(self):
+        if not os.path.exists(self.fallback_path):
+            return []
+        with open(self.fallback_path) as fallback_file:
+            return fallback_file.read().splitlines()
+
+    def test_records_are_stored(self):
+        self.handler.write_batch(self.build_records(3))
+
+        self.assertEqual(RequestLog.objects.count(), 3)
+        self.assertEqual(self.read_fallback(), [])
+
+    def test_database_outage_writes_the_fallback_file(self):
+        with mock.patch.object(RequestLog.objects, 'bulk_create', side_effect=OperationalError('server closed the connection')), \
+                self.assertLogs('log_processor', 'ERROR'):
+            self.handler.write_batch(self.build_records(3))
+
+        self.assertEqual(RequestLog.objects.count(), 0)
+        self.assertEqual(self.handler.fallback_records, 3)
+        self.assertEqual(self.read_fallback(), ['Response: 0', 'Response: 1', 'Response: 2'])
+
+        # The database isn't retried before the retry interval
+        self.handler.write_batch(self.build_records(1))
+        self.assertEqual(RequestLog.objects.count(), 0)
+        self.assertEqual(self.handler.fallback_records, 4)
+
+
+class LogSchedulerTest(SimpleTestCase):
+
+    @mock.patch('common_django.logging_app.schedular.LOG_SCHEDULER_LOCK_RETRY', 0)
+    def test_lock_database_error_is_retried(self):
+        scheduler = LogScheduler('minutes', interval=1)
+
+        def acquire_after_outage():
+            if lock.acquire.call_count == 1:
+                raise OperationalError('could not connect to server')
+            scheduler.stop()
+            return True
+
+        lock = scheduler.lock = mock.Mock()
+        lock.acquire.side_effect = acquire_after_outage
+        with self.assertLogs('log_scheduler', 'ERROR'):
+            scheduler.start()
+
+        self.assertEqual(lock.acquire.call_count, 2)
+        lock.release.assert_called_once()
+
+
+class RetentionTest(TestCase):
+
+    def test_expired_rollups_are_deleted(self):
+        view_metadata = ViewMetadata.objects.create(
+            app_name='orders', view='order-detail', class_name='Unknown', function_name='order_detail', line_number=10,
+        )
+        user = User.objects.create(username='retention', email='retention@example.com')
+        current_hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for days in (1, 10, 40, 50):
+            hour = current_hour - timedelta(days=days)
+            RequestRollup.objects.create(minute=hour, view_metadata=view_metadata, method='GET', status_code=200, count=1)
+            UserTrafficRollup.objects.create(hour=hour, user=user, count=1)
+
+        self.assertEqual(retention.prune_rollups(30, dry_run=True), 4)
+        self.assertEqual(retention.prune_rollups(30, chunk_size=1), 4)
+        self.assertEqual(RequestRollup.objects.count(), 2)
+        self.assertEqual(UserTrafficRollup.objects.count(), 2)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class SimpleLoggingMiddlewareTest(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def get_log_records(self, request, view=order_detail):
+        """
+        Returns the structured records logged for the request, the view is called without
+        resolving the URL first, like the request handler does after the middleware.
+        """
+        middleware = SimpleLoggingMiddleware(lambda request: view(request, 1))
+        with self.assertLogs('request_logger', 'INFO') as logs:
+            middleware(request)
+        return {record.log_record_type: record.log_data for record in logs.records}
+
+    def build_request(self, path, method='get', data=None):
+        request = getattr(self.factory, method)(path, data)
+        request.user = AnonymousUser()
+        return request
+
+    def test_request_record_has_the_view(self):
+        records = self.get_log_records(self.build_request('/orders/1/'))
+
+        self.assertEqual(records['Request']['view'], 'order-detail')
+        self.assertEqual(records['Request']['function_name'], 'order_detail')
+        self.assertEqual(records['Response']['view'], 'order-detail')
+
+    def test_unknown_url_has_no_view(self):
+        records = self.get_log_records(self.build_request('/missing/'))
+
+        self.assertEqual(records['Request']['view'], 'Unknown')
+        self.assertEqual(records['Response']['view'], 'Unknown')
+
+    def test_unparsed_body_is_not_read(self):
+        request = self.build_request('/orders/1/?page=2', method='post', data={'quantity': '3'})
+        records = self.get_log_records(request)
+
+        self.assertNotIn('_post', request.__dict__)
+        self.assertEqual(records['Request']['request_params'], {'page': '2'})
+
+    @override_settings(LOG_COMBINED_RECORD=True)
+    def test_parsed_body_is_logged(self):
+        def order_update(request, number):
+            return HttpResponse(request.POST['quantity'])
+
+        request = self.build_request('/orders/1/', method='post', data={'quantity': '3', 'password': 'hunter2'})
+        records = self.get_log_records(request, view=order_update)
+
+        # The combined record is logged after the view parsed the body
+        self.assertEqual(records['Access']['request_params'], {'quantity': '3', 'password': REDACTED_VALUE})
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class SessionUserTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='session', email='session@example.com', password='first')
+
+    def build_request(self):
+        """
+        Returns a request of the logged in user whose user the view doesn't load, like the
+        authentication middleware leaves it.
+        """
+        request = RequestFactory().get('/orders/1/')
+        request.session = SessionStore()
+        request.session.update({
+            SESSION_KEY: str(self.user.pk),
+            BACKEND_SESSION_KEY: 'django.contrib.auth.backends.ModelBackend',
+            HASH_SESSION_KEY: self.user.get_session_auth_hash(),
+        })
+        AuthenticationMiddleware(order_detail).process_request(request)
+        return request
+
+    def test_session_user_is_logged(self):
+        request = self.build_request()
+
+        user_fields = SimpleLoggingMiddleware(order_detail).get_log_user_fields(request)
+
+        self.assertEqual(user_fields, {'user': self.user, 'user_id': self.user.pk})
+        # The verified user is reused by request.user
+        with self.assertNumQueries(0):
+            self.assertEqual(request.user, self.user)
+
+    def test_session_of_a_changed_password_is_anonymous(self):
+        request = self.build_request()
+        self.user.set_password('second')
+        self.user.save()
+
+        user_fields = SimpleLoggingMiddleware(order_detail).get_log_user_fields(request)
+
+        self.assertEqual(user_fields, {'user': 'Anonymous', 'user_id': None})
+        self.assertNotIn(SESSION_KEY, request.session)
+
+
+class RequestParamsCaptureTest(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_query_string_is_redacted(self):
+        request = self.factory.get('/orders/', {'page': '2', 'api_token': 'abc'})
+        capture = RequestParamsCapture()
+
+        self.assertEqual(capture.capture(request), {'page': '2', 'api_token': REDACTED_VALUE})
+        self.assertEqual(capture.get_full_path(request), f'/orders/?page=2&api_token={REDACTED_VALUE}')
+
+    def test_query_mode_ignores_the_body(self):
+        request = self.factory.post('/orders/?page=2', {'quantity': '3'})
+        request.POST  # Parsed by the view
+
+        self.assertEqual(RequestParamsCapture(mode='query').capture(request), {'page': '2'})
+        self.assertEqual(RequestParamsCapture(mode='off').capture(request), {})
+        self.assertEqual(RequestParamsCapture(mode='off').get_full_path(request), '/orders/')
+
+    def test_parameters_are_capped_in_number(self):
+        params = {f'key{number}': 'value' for number in range(5)}
+
+        capped = RequestParamsCapture(max_keys=3).cap(params)
+
+        self.assertEqual(list(capped), ['key0', 'key1', 'key2', TRUNCATED_KEY])
+        self.assertTrue(capped[TRUNCATED_KEY])
+
+    def test_parameters_are_capped_in_size(self):
+        params = {'name': 'x' * 10, 'description': 'y' * 100, 'quantity': '3'}
+
+        capped = RequestParamsCapture(max_bytes=30).cap(params)
+
+        # 14 bytes for the name, what fits of the description and the quantity is left out
+        self.assertEqual(capped, {'name': 'x' * 10, 'description': 'y' * 5, TRUNCATED_KEY: True})
+
+    def test_invalid_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            RequestParamsCapture(mode='all')
+
+
+class MetricsViewTest(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def get_metrics(self, user=None, **headers):
+        request = self.factory.get('/metrics/', headers=headers)
+        request.user = user or AnonymousUser()
+        return views.metrics(request)
+
+    def test_anonymous_requests_are_denied(self):
+        with self.assertRaises(PermissionDenied):
+            self.get_metrics()
+        with self.assertRaises(PermissionDenied):
+            self.get_metrics(user=User(username='member', is_staff=False))
+
+    def test_staff_users_are_served(self):
+        self.assertEqual(self.get_metrics(user=User(username='admin', is_staff=True)).status_code, 200)
+
+    @override_settings(LOG_METRICS_TOKEN='scrape-token')
+    def test_scrapers_need_the_token(self):
+        self.assertEqual(self.get_metrics(Authorization='Bearer scrape-token').status_code, 200)
+        with self.assertRaises(PermissionDenied):
+            self.get_metrics(Authorization='Bearer other-token')
+
+
+class LogFilesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.log_file_path = os.path.join(self.directory, 'request_logs.log')
+        self.processor = LogProcessor(self.log_file_path, os.path.join(self.directory, 'request_logs.checkpoint.json'))
+
+    def test_vanished_files_are_skipped(self):
+        for suffix in ('', '.1', '.2.gz'):
+            with open(f'{self.log_file_path}{suffix}', 'wb') as log_file:
+                log_file.write(b'line\n')
+
+        # The archive is removed by log rotation after being listed
+        getmtime = os.path.getmtime
+
+        def getmtime_after_rotation(path):
+            if path.endswith('.2.gz'):
+                raise FileNotFoundError(path)
+            return getmtime(path)
+
+        with mock.patch('os.path.getmtime', side_effect=getmtime_after_rotation):
+            log_files = self.processor.get_log_files()
+
+        self.assertEqual(sorted(log_files), [self.log_file_path, f'{self.log_file_path}.1'])
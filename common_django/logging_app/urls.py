@@ -0,0 +1,6 @@
+from django.urls import path
+from common_django.logging_app import views
+
+urlpatterns = [
+    path('metrics/', views.metrics, name='request_log_metrics'),
+]
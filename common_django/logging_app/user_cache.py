@@ -0,0 +1,48 @@
+import time
+import threading
+from collections import OrderedDict
+
+# Returned by UserIdCache.get() for emails that aren't cached
+MISSING = object()
+
+
+class UserIdCache:
+    """
+    A bounded, thread-safe LRU cache mapping user emails to user ids, used by the LogProcessor
+    so the same users aren't looked up again for every log entry. Emails without a user are
+    cached as None. Entries expire after ttl seconds when a ttl is given.
+    """
+
+    def __init__(self, max_size=10000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        """
+        Returns the cached user id (or None) for the email, or MISSING if it isn't cached.
+        """
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return MISSING
+
+            user_id, cached_at = entry
+            if self.ttl is not None and time.monotonic() - cached_at > self.ttl:
+                del self._entries[email]
+                return MISSING
+
+            self._entries.move_to_end(email)
+            return user_id
+
+    def set(self, email, user_id):
+        with self._lock:
+            self._entries[email] = (user_id, time.monotonic())
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from common_django.logging_app.metrics import get_metrics
+
+
+def metrics(request):
+    """
+    Returns the metrics of the log processor and the scheduler in the Prometheus text format.
+    Only the metrics of the process serving the request are returned, the ingest_request_logs
+    command serves its own with --metrics-port.
+
+    The metrics are only served to staff users, or to scrapers sending the LOG_METRICS_TOKEN
+    bearer token.
+    """
+    if not can_read_metrics(request):
+        raise PermissionDenied
+    return HttpResponse(get_metrics().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def can_read_metrics(request):
+    """
+    Returns True if the request carries the LOG_METRICS_TOKEN bearer token or comes from an active staff user.
+    """
+    token = getattr(settings, 'LOG_METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+    if token and authorization.startswith('Bearer ') and constant_time_compare(authorization[len('Bearer '):], token):
+        return True
+
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_active and user.is_staff
@@ -0,0 +1,194 @@
+"""
+Watchers waking the ingestion daemon up when the log files change:
+
+    watcher = get_watcher(processor)
+    while True:
+        processor.run()
+        watcher.wait(timeout)
+
+InotifyWatcher (Linux) is notified by the kernel of writes, creations and renames in the
+directories of the log files, so it costs nothing while the files are idle. PollingWatcher
+compares the size and modification time of the log files at a fixed interval, elsewhere.
+"""
+import os
+import glob
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+from fnmatch import fnmatch
+
+# Logger shared with the log processor
+logger = logging.getLogger('log_processor')
+
+# Seconds to wait after a change for more changes, so a burst of writes wakes the daemon once
+WATCH_DEBOUNCE = 0.2
+
+# Seconds between two checks of the PollingWatcher
+POLL_INTERVAL = 1.0
+
+# inotify constants, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    Waits for log files matching the patterns to be written, created or renamed into place, using inotify.
+    """
+
+    def __init__(self, patterns, include_rotated=True, libc=None):
+        self.libc = libc or load_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        # File name patterns by watched directory
+        self.name_patterns = {}
+        for pattern in patterns:
+            directory, name = os.path.split(os.path.abspath(str(pattern)))
+            directories = glob.glob(directory) if glob.has_magic(directory) else [directory]
+            for directory in directories:
+                names = self.name_patterns.setdefault(directory, set())
+                names.add(name)
+                if include_rotated:
+                    names.add(f"{name}.*")
+
+        self.watches = {}
+        for directory in self.name_patterns:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_MODIFY | IN_CREATE | IN_MOVED_TO)
+            if wd < 0:
+                logger.warning(f"Can't watch {directory}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self.watches[wd] = directory
+
+        if not self.watches:
+            self.close()
+            raise OSError(errno.ENOENT, "None of the log file directories can be watched")
+
+    def wait(self, timeout=None):
+        """
+        Blocks until a log file changes or until timeout seconds have passed,
+        returns True if a log file changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return False
+
+            if self.read_events():
+                # Let the writer finish its burst of writes
+                time.sleep(WATCH_DEBOUNCE)
+                self.read_events()
+                return True
+
+    def read_events(self):
+        """
+        Reads the pending events, returns True if one of them concerns a log file.
+        """
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            if not data:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+                offset += name_length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, assume a log file changed
+                    changed = True
+                elif wd in self.watches:
+                    changed = changed or any(fnmatch(name, pattern) for pattern in self.name_patterns[self.watches[wd]])
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """
+    Waits for log files to change by comparing their size and modification time at a fixed interval.
+    """
+
+    def __init__(self, list_files, poll_interval=POLL_INTERVAL):
+        """
+        :param list_files: Callable returning the paths of the log files.
+        :param poll_interval: Seconds between two checks.
+        """
+        self.list_files = list_files
+        self.poll_interval = poll_interval
+        self.signature = self.get_signature()
+
+    def get_signature(self):
+        signature = {}
+        for path in self.list_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature[path] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        return signature
+
+    def wait(self, timeout=None):
+        """
+        Blocks until a log file changes or until timeout seconds have passed,
+        returns True if a log file changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            signature = self.get_signature()
+            if signature != self.signature:
+                self.signature = signature
+                return True
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+
+    def close(self):
+        pass
+
+
+def load_libc():
+    """
+    Returns the C library if it provides inotify, raises OSError otherwise.
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, "inotify isn't available")
+    return libc
+
+
+def get_watcher(processor, poll_interval=POLL_INTERVAL):
+    """
+    Returns an inotify watcher for the log files of the LogProcessor, or a polling watcher
+    where inotify isn't available.
+    """
+    patterns = processor.log_file_path
+    if isinstance(patterns, (str, os.PathLike)):
+        patterns = [patterns]
+
+    try:
+        return InotifyWatcher(patterns, processor.include_rotated)
+    except (OSError, AttributeError) as e:
+        logger.info(f"Watching the log files by polling every {poll_interval}s ({e}).")
+        return PollingWatcher(processor.get_log_files, poll_interval)